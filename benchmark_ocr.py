@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark the OCR output profiles on a sample PDF.
+Each profile in modules.ocr.OCR_PROFILES is run on the same input and its wall time
+and output size are reported, to choose a profile per publication.
+
+Usage:
+  python benchmark_ocr.py sample.pdf [--language ita] [--profiles fast,small] [--jobs 4]
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+from modules import config
+from modules.ocr import OCR_PROFILES, run_ocr
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def benchmark(input_path: Path, language: str, profiles: list[str], jobs: int) -> int:
+    input_size = input_path.stat().st_size
+    print(f"Input: {input_path} ({input_size / 1024 / 1024:.1f} MB), language {language}, {jobs} jobs")
+    print(f"{'profile':<10} {'time (s)':>10} {'size (MB)':>10} {'ratio':>7}")
+
+    exit_code = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for profile in profiles:
+            output_path = Path(temp_dir) / f"{profile}.pdf"
+            started = time.monotonic()
+            result = run_ocr(input_path, output_path, language, jobs, profile)
+            elapsed = time.monotonic() - started
+
+            if result != 0:
+                logger.error(f"Profile {profile} failed with exit code {result}")
+                exit_code = 1
+                continue
+
+            output_size = output_path.stat().st_size
+            print(f"{profile:<10} {elapsed:>10.1f} {output_size / 1024 / 1024:>10.1f} {output_size / input_size:>7.2f}")
+
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR output profiles on a sample PDF")
+    parser.add_argument("input", type=Path, help="sample PDF, e.g. a .temp.pdf from the downloads folder")
+    parser.add_argument("--language", default="ita", help="OCR language (default: ita)")
+    parser.add_argument("--profiles", default=",".join(OCR_PROFILES), help="comma separated profiles to run (default: all)")
+    parser.add_argument("--jobs", type=int, default=config.OCR_JOBS or 1, help="ocrmypdf jobs (default: OCR_JOBS or 1)")
+    args = parser.parse_args()
+
+    if not args.input.exists():
+        logger.error(f"Input file not found: {args.input}")
+        sys.exit(2)
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    unknown = [p for p in profiles if p not in OCR_PROFILES]
+    if unknown:
+        logger.error(f"Unknown profiles: {', '.join(unknown)} (available: {', '.join(OCR_PROFILES)})")
+        sys.exit(2)
+
+    sys.exit(benchmark(args.input, args.language, profiles, args.jobs))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,35 +10,42 @@ warnings.filterwarnings("ignore")
 load_dotenv()
 from modules import config
 
-# Configure logging
-log_level = config.LOG_LEVEL
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
-# Initialize database
-from modules.database import init_db
-init_db()
+# Setup lives in main(): the spawned OCR worker processes re-import this module,
+# and must not configure logging, open the database or import the threads again
+def main():
+    # Configure logging
+    log_level = config.LOG_LEVEL
+    logging.basicConfig(
+        level=getattr(logging, log_level),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
 
-# Import threads
-from threads.scheduler import SchedulerThread
-from threads.downloader import DownloaderThread
-from threads.ocr_processor import OCRProcessorThread
-from threads.telegram_uploader import TelegramUploaderThread
-from threads.api_server import start_api_server
+    # Initialize database
+    from modules.database import init_db, get_writer
+    init_db()
+
+    # Import threads
+    from threads.scheduler import SchedulerThread
+    from threads.downloader import DownloaderThread
+    from threads.ocr_processor import OCRProcessorThread
+    from threads.telegram_uploader import TelegramUploaderThread
+    from threads.api_server import start_api_server
 
-def main():
     logger.info("Starting PR Manager")
     
     # Start threads
     threads = []
 
+    # Database writer thread, committing the writes of all other threads in groups
+    db_writer = get_writer()
+    threads.append(db_writer)
+    logger.info("Database writer thread started")
+
     # Scheduler thread
     scheduler = SchedulerThread()
     scheduler.daemon = True 
@@ -29,6 +29,8 @@ LOG_LEVEL: str = _get_str("LOG_LEVEL", "INFO")
 DATA_FOLDER: Path = Path("data")
 DOWNLOAD_FOLDER: Path = DATA_FOLDER / "downloads"
 OCR_FOLDER: Path = DATA_FOLDER / "ocr_output"
+OCR_CACHE_FOLDER: Path = DATA_FOLDER / "ocr_cache"
+TELEGRAM_CACHE_FOLDER: Path = DATA_FOLDER / "telegram_cache"
 DONE_FOLDER: Path = DATA_FOLDER / "done"
 DATABASE_PATH: Path = DATA_FOLDER / "pr.db"
 TELEGRAM_SESSION: Path = DATA_FOLDER / "telegram.session"
@@ -38,6 +40,8 @@ LITE_JWT_TOKEN: Path = DATA_FOLDER / "lite_jwt.token"
 DATA_FOLDER.mkdir(parents=True, exist_ok=True)
 DOWNLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 OCR_FOLDER.mkdir(parents=True, exist_ok=True)
+OCR_CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+TELEGRAM_CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
 DONE_FOLDER.mkdir(parents=True, exist_ok=True)
 DATABASE_PATH.parent.mkdir(parents=True, exist_ok=True)
 TELEGRAM_SESSION.parent.mkdir(parents=True, exist_ok=True)
@@ -63,11 +67,39 @@ MIN_SCALE: int = _get_int("MIN_SCALE", 50) or 50
 SCALE_STEP: int = _get_int("SCALE_STEP", 5) or 5
 MAX_RETRIES: int = _get_int("MAX_RETRIES", 10) or 10
 CHROMIUM_TIMEOUT: int = _get_int("CHROMIUM_TIMEOUT", 5000) or 5000
+MAX_REQUESTS_PER_HOST: int = _get_int("MAX_REQUESTS_PER_HOST", 8) or 8
+HTTP_TIMEOUT: int = _get_int("HTTP_TIMEOUT", 30) or 30
+RETRY_BASE_DELAY: int = _get_int("RETRY_BASE_DELAY", 1) or 1
+RETRY_MAX_DELAY: int = _get_int("RETRY_MAX_DELAY", 60) or 60
+BREAKER_THRESHOLD: int = _get_int("BREAKER_THRESHOLD", 10) or 10
+BREAKER_COOLDOWN: int = _get_int("BREAKER_COOLDOWN", 60) or 60
+PAGE_KEYS_TTL: int = _get_int("PAGE_KEYS_TTL", 3600) or 3600
+CATALOG_WORKERS: int = _get_int("CATALOG_WORKERS", 16) or 16
+CATALOG_CACHE_TTL: int = _get_int("CATALOG_CACHE_TTL", 300) or 300
+DOWNLOAD_WORKERS: int = _get_int("DOWNLOAD_WORKERS", 4) or 4
+DOWNLOAD_WORKERS_PER_PUBLICATION: int = _get_int("DOWNLOAD_WORKERS_PER_PUBLICATION", 1) or 1
+OCR_WORKERS: int = _get_int("OCR_WORKERS", 2) or 2
+OCR_JOBS: int = _get_int("OCR_JOBS", 0) or 0
+OCR_STREAMING: bool = _get_bool("OCR_STREAMING") or False
+OCR_CACHE_SIZE_MB: int = _get_int("OCR_CACHE_SIZE_MB", 2048) or 2048
+OCR_PROFILE: str = _get_str("OCR_PROFILE", "fast")
+WATCHER_POLL_INTERVAL: int = _get_int("WATCHER_POLL_INTERVAL", 10) or 10
+WORKFLOW_LEASE_SECONDS: int = _get_int("WORKFLOW_LEASE_SECONDS", 3600) or 3600
+WORKFLOW_MAX_ATTEMPTS: int = _get_int("WORKFLOW_MAX_ATTEMPTS", 5) or 5
+DB_WRITE_BATCH_SIZE: int = _get_int("DB_WRITE_BATCH_SIZE", 256) or 256
+DB_WRITE_DELAY_MS: int = _get_int("DB_WRITE_DELAY_MS", 5) or 0
+TELEGRAM_UPLOAD_CONNECTIONS: int = _get_int("TELEGRAM_UPLOAD_CONNECTIONS", 4) or 0
+TELEGRAM_UPLOAD_CONCURRENCY: int = _get_int("TELEGRAM_UPLOAD_CONCURRENCY", 3) or 1
+TELEGRAM_UPLOAD_MODE: str = _get_str("TELEGRAM_UPLOAD_MODE", "thumb")
+TELEGRAM_CACHE_SIZE_MB: int = _get_int("TELEGRAM_CACHE_SIZE_MB", 1024) or 1024
+TELEGRAM_CACHE_MAX_AGE: int = _get_int("TELEGRAM_CACHE_MAX_AGE", 86400) or 86400
 
 __all__ = [
     "LOG_LEVEL",
     "DOWNLOAD_FOLDER",
     "OCR_FOLDER",
+    "OCR_CACHE_FOLDER",
+    "TELEGRAM_CACHE_FOLDER",
     "API_HOST",
     "API_PORT",
     "DATABASE_PATH",
@@ -86,4 +118,30 @@ __all__ = [
     "SCALE_STEP",
     "MAX_RETRIES",
     "CHROMIUM_TIMEOUT",
+    "MAX_REQUESTS_PER_HOST",
+    "HTTP_TIMEOUT",
+    "RETRY_BASE_DELAY",
+    "RETRY_MAX_DELAY",
+    "BREAKER_THRESHOLD",
+    "BREAKER_COOLDOWN",
+    "PAGE_KEYS_TTL",
+    "CATALOG_WORKERS",
+    "CATALOG_CACHE_TTL",
+    "DOWNLOAD_WORKERS",
+    "DOWNLOAD_WORKERS_PER_PUBLICATION",
+    "OCR_WORKERS",
+    "OCR_JOBS",
+    "OCR_STREAMING",
+    "OCR_CACHE_SIZE_MB",
+    "OCR_PROFILE",
+    "WATCHER_POLL_INTERVAL",
+    "WORKFLOW_LEASE_SECONDS",
+    "WORKFLOW_MAX_ATTEMPTS",
+    "DB_WRITE_BATCH_SIZE",
+    "DB_WRITE_DELAY_MS",
+    "TELEGRAM_UPLOAD_CONNECTIONS",
+    "TELEGRAM_UPLOAD_CONCURRENCY",
+    "TELEGRAM_UPLOAD_MODE",
+    "TELEGRAM_CACHE_SIZE_MB",
+    "TELEGRAM_CACHE_MAX_AGE",
 ]
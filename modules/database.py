@@ -1,13 +1,92 @@
 import json
-from datetime import datetime
+import os
+import socket
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 from pathlib import Path
+from threading import Lock
+from typing import Any, Callable
 
 from modules import config
+from modules.db_writer import DatabaseWriter
 
-from peewee import SqliteDatabase, Model, CharField, IntegerField, BooleanField, DateTimeField
+from peewee import SqliteDatabase, Model, CharField, IntegerField, BooleanField, DateTimeField, TextField, Expression, SQL
+from playhouse.migrate import SqliteMigrator, migrate
 
 db_path = str(config.DATABASE_PATH)
-db = SqliteDatabase(db_path)
+
+# WAL lets readers run alongside the writer; each thread keeps its own connection
+# open (peewee autoconnect), so call sites never connect or close explicitly.
+DB_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64 * 1024,  # 64 MiB
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+    "temp_store": "memory",
+}
+
+db = SqliteDatabase(db_path, pragmas=DB_PRAGMAS)
+
+_writer: DatabaseWriter | None = None
+_writer_lock = Lock()
+
+def get_writer() -> DatabaseWriter:
+    """Return the database writer thread, starting it on first use"""
+    global _writer
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = DatabaseWriter(db, config.DB_WRITE_BATCH_SIZE, config.DB_WRITE_DELAY_MS / 1000)
+            _writer.start()
+        return _writer
+
+def write(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run a write on the database writer thread, grouped with concurrent writes into one transaction.
+    Call result() on the returned future to wait until the write is durable."""
+    return get_writer().submit(fn, *args, **kwargs)
+
+def _resolved(result: Any) -> Future:
+    future: Future = Future()
+    future.set_result(result)
+    return future
+
+# Workflow states, in pipeline order
+STATE_QUEUED = "queued"
+STATE_DOWNLOADING = "downloading"
+STATE_DOWNLOADED = "downloaded"
+STATE_OCR = "ocr"
+STATE_PROCESSED = "processed"
+STATE_UPLOADING = "uploading"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+WORKFLOW_STATES = (
+    STATE_QUEUED,
+    STATE_DOWNLOADING,
+    STATE_DOWNLOADED,
+    STATE_OCR,
+    STATE_PROCESSED,
+    STATE_UPLOADING,
+    STATE_DONE,
+    STATE_FAILED,
+)
+
+# Ready state of each stage -> state held while a worker has the lease on it
+STAGE_STATES = {
+    STATE_QUEUED: STATE_DOWNLOADING,
+    STATE_DOWNLOADED: STATE_OCR,
+    STATE_PROCESSED: STATE_UPLOADING,
+}
+
+def _in_state(state: str) -> SQL:
+    # A literal rather than a bound parameter: SQLite only uses a partial index
+    # when the query repeats the index condition verbatim
+    return SQL(f"state = '{state}'")
+
+def get_worker_id(name: str) -> str:
+    """Lease owner id of a worker, unique across processes and hosts sharing the database"""
+    return f"{socket.gethostname()}:{os.getpid()}:{name}"
 
 class BaseModel(Model):
     class Meta:
@@ -18,7 +97,9 @@ class Publication(BaseModel):
     display_name = CharField(null=True)
     issue_id = CharField()
     max_scale = IntegerField()
+    learned_scale = IntegerField(null=True)
     language = CharField()
+    ocr_profile = CharField(null=True)
     enabled = BooleanField(default=True)
     last_finished = CharField(null=True)
     created_at = DateTimeField(default=datetime.now)
@@ -26,22 +107,198 @@ class Publication(BaseModel):
 class FileWorkflow(BaseModel):
     publication_name = CharField()
     key = CharField()
+    # Derived from key on save(), for indexed lookups by issue date
+    issue_date = CharField(null=True)
+    issue_version = IntegerField(null=True)
     downloaded = BooleanField(default=False)
     ocr_processed = BooleanField(default=False)
     uploaded = BooleanField(default=False)
+    state = CharField(default=STATE_QUEUED)
+    attempts = IntegerField(default=0)
+    lease_owner = CharField(null=True)
+    lease_expires_at = DateTimeField(null=True)
     channel_id = IntegerField(null=True)
     message_id = IntegerField(null=True)
+    page_keys = TextField(null=True)
+    page_keys_fetched_at = DateTimeField(null=True)
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
     
     class Meta:
         indexes = (
             (('publication_name', 'key'), True),
+            (('publication_name', 'issue_date', 'issue_version'), False),
+        )
+
+    def save(self, *args, **kwargs):
+        # Same layout as utils.get_fw_date / utils.get_fw_ver
+        key = str(self.key)
+        self.issue_date = key[4:12]
+        self.issue_version = int(key[12:20]) if key[12:20].isdigit() else None
+        return super().save(*args, **kwargs)
+
+    @classmethod
+    def get_issue(cls, publication_name: str, issue_date: str, *filters) -> "FileWorkflow | None":
+        """Return the latest version of an issue, using the (publication_name, issue_date, issue_version) index"""
+        return (
+            cls.select()
+            .where(
+                (cls.publication_name == publication_name) &
+                (cls.issue_date == issue_date),
+                *filters
+            )
+            .order_by(cls.issue_version.desc())
+            .first()
+        )
+
+    @classmethod
+    def get_ready_issue(cls, publication_name: str, issue_date: str, ready_state: str) -> "FileWorkflow | None":
+        """Return the version of an issue waiting in a stage's ready state, or else the latest version.
+        A date can have several rows (e.g. a manual download next to the catalog issue), and the
+        latest one may be past the stage while another one still waits in it."""
+        return (
+            cls.get_issue(publication_name, issue_date, cls.claimable(ready_state))
+            or cls.get_issue(publication_name, issue_date)
         )
 
+    @classmethod
+    def claimable(cls, ready_state: str) -> Expression:
+        """Workflows waiting in a stage's ready state, or whose lease on the stage expired (crashed worker)"""
+        # Both branches constrain lease_expires_at, so SQLite can answer each from its partial index
+        return (_in_state(ready_state) & cls.lease_expires_at.is_null()) | (
+            _in_state(STAGE_STATES[ready_state]) & (cls.lease_expires_at < datetime.now())
+        )
+
+    @classmethod
+    def pending(cls, ready_state: str, limit: int | None = None) -> list["FileWorkflow"]:
+        """Oldest claimable workflows of a stage, read from the partial state indexes"""
+        return list(cls.select().where(cls.claimable(ready_state)).order_by(cls.created_at).limit(limit))
+
+    @classmethod
+    def claim(cls, ids: list[int], ready_state: str, owner: str) -> list["FileWorkflow"]:
+        """Atomically lease workflows for the stage starting at ready_state.
+        Workflows claimed by another worker in the meantime are left out.
+
+        Returns:
+            The workflows now leased by owner.
+        """
+        if not ids:
+            return []
+        return write(cls._claim, ids, ready_state, owner).result()
+
+    @classmethod
+    def _claim(cls, ids: list[int], ready_state: str, owner: str) -> list["FileWorkflow"]:
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=config.WORKFLOW_LEASE_SECONDS)
+        # IMMEDIATE takes the write lock up front, so concurrent claims serialize
+        with db.atomic("IMMEDIATE"):
+            cls.update(
+                state=STAGE_STATES[ready_state],
+                lease_owner=owner,
+                lease_expires_at=expires_at,
+                updated_at=now,
+            ).where(cls.id.in_(ids) & cls.claimable(ready_state)).execute()
+            return list(cls.select().where(
+                cls.id.in_(ids) &
+                (cls.lease_owner == owner) &
+                (cls.lease_expires_at == expires_at)
+            ))
+
+    def release(self, state: str, **fields) -> Future:
+        """Move a leased workflow to state and drop the lease, setting any extra fields.
+        Attempts are counted per stage: unless given, they start over at 0 for the next stage.
+        The future resolves to False if the lease was lost (expired and taken over, or the workflow was deleted),
+        or right away if this workflow was already released."""
+        if self.lease_owner is None:
+            return _resolved(False)
+        fields.setdefault("attempts", 0)
+        fields.update(state=state, lease_owner=None, lease_expires_at=None, updated_at=datetime.now())
+        query = type(self).update(**fields).where(
+            (type(self).id == self.id) &
+            (type(self).lease_owner == self.lease_owner)
+        )
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return write(lambda: query.execute() > 0)
+
+    def extend_lease(self, seconds: float) -> Future:
+        """Keep holding a leased workflow for another `seconds`, e.g. across a long Telegram flood wait.
+        The future resolves to False if the lease was lost."""
+        if self.lease_owner is None:
+            return _resolved(False)
+        expires_at = datetime.now() + timedelta(seconds=seconds)
+        query = type(self).update(lease_expires_at=expires_at, updated_at=datetime.now()).where(
+            (type(self).id == self.id) &
+            (type(self).lease_owner == self.lease_owner)
+        )
+        self.lease_expires_at = expires_at
+        return write(lambda: query.execute() > 0)
+
+    def release_failed(self, ready_state: str) -> Future:
+        """Return a leased workflow to its stage's ready state for a retry,
+        or mark it failed after WORKFLOW_MAX_ATTEMPTS attempts"""
+        attempts = int(self.attempts or 0) + 1
+        state = STATE_FAILED if attempts >= config.WORKFLOW_MAX_ATTEMPTS else ready_state
+        return self.release(state, attempts=attempts)
+
+# One partial index per state: each stage reads its queue from a small index instead of scanning the table
+for _state in WORKFLOW_STATES:
+    FileWorkflow.add_index(FileWorkflow.index(
+        FileWorkflow.lease_expires_at,
+        FileWorkflow.created_at,
+        name=f"fileworkflow_state_{_state}",
+        where=_in_state(_state),
+    ))
+
+class CatalogCache(BaseModel):
+    issue_id = CharField(unique=True)
+    etag = CharField(null=True)
+    last_modified = CharField(null=True)
+    content_hash = CharField()
+    body = TextField()
+    fetched_at = DateTimeField(default=datetime.now)
+
+def _add_missing_columns(models: list[type[BaseModel]]) -> set[tuple[str, str]]:
+    """Add columns introduced after the tables were first created.
+    Returns the (table, column) pairs that were added."""
+    migrator = SqliteMigrator(db)
+    added: set[tuple[str, str]] = set()
+    for model in models:
+        table = model._meta.table_name
+        if not model.table_exists():
+            continue
+        existing = {column.name for column in db.get_columns(table)}
+        operations = [
+            migrator.add_column(table, field.column_name, field)
+            for field in model._meta.sorted_fields
+            if field.column_name not in existing
+        ]
+        if operations:
+            migrate(*operations)
+            added.update((table, field.column_name) for field in model._meta.sorted_fields if field.column_name not in existing)
+    return added
+
+def _backfill_states():
+    """Derive the state of workflows created before the state column from their stage flags"""
+    FileWorkflow.update(state=STATE_DONE).where(FileWorkflow.uploaded == True).execute()
+    FileWorkflow.update(state=STATE_PROCESSED).where(
+        (FileWorkflow.ocr_processed == True) & (FileWorkflow.uploaded == False)
+    ).execute()
+    FileWorkflow.update(state=STATE_DOWNLOADED).where(
+        (FileWorkflow.downloaded == True) & (FileWorkflow.ocr_processed == False)
+    ).execute()
+
 def init_db():
     db.connect()
-    db.create_tables([Publication, FileWorkflow])
+    # Columns first, so indexes on new columns can be created on existing tables
+    added = _add_missing_columns([Publication, FileWorkflow, CatalogCache])
+    db.create_tables([Publication, FileWorkflow, CatalogCache])
+
+    if (FileWorkflow._meta.table_name, "state") in added:
+        _backfill_states()
+
+    for fw in FileWorkflow.select().where(FileWorkflow.issue_date.is_null()):
+        fw.save()
     
     input_file = Path(__file__).parent.parent / "input.json"
     if input_file.exists():
@@ -54,7 +311,8 @@ def init_db():
                         'issue_id': pub['issue_id'],
                         'max_scale': pub['max_scale'],
                         'language': pub['language'],
-                        'display_name': pub.get('display_name', None)
+                        'display_name': pub.get('display_name', None),
+                        'ocr_profile': pub.get('ocr_profile', None)
                     }
                 )
     db.close()
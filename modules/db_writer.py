@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Any, Callable
+
+from peewee import Database
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Single thread performing the database writes of every other thread.
+    Writes queued while a transaction runs are committed together in the next one
+    (group commit), so concurrent status updates share one commit and one fsync
+    instead of contending for the SQLite write lock.
+    Each write runs in its own savepoint: a failing write only fails its own future.
+    """
+
+    def __init__(self, database: Database, max_batch: int, max_delay: float):
+        super().__init__(daemon=True, name="DatabaseWriter")
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.status = "waiting"
+        self.commits = 0
+        self.writes = 0
+        self._queue: Queue[tuple[Callable[..., Any], tuple, dict, Future]] = Queue()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Queue a write. The returned future resolves to fn's result once its transaction committed."""
+        future: Future = Future()
+        if threading.current_thread() is self:
+            # Already inside a batch (a write queuing another one), run it in place
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def _collect(self) -> list[tuple[Callable[..., Any], tuple, dict, Future]]:
+        """Block for the next write, then gather those arriving within max_delay, up to max_batch"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except Empty:
+                break
+        return batch
+
+    def _commit(self, batch: list[tuple[Callable[..., Any], tuple, dict, Future]]):
+        results: list[tuple[Future, Any, Exception | None]] = []
+        try:
+            with self.database.atomic("IMMEDIATE"):
+                for fn, args, kwargs, future in batch:
+                    try:
+                        with self.database.atomic():
+                            results.append((future, fn(*args, **kwargs), None))
+                    except Exception as e:
+                        logger.error(f"Database write {getattr(fn, '__qualname__', fn)} failed: {e}")
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed, none of the batch is durable
+            logger.error(f"Failed to commit {len(batch)} database writes: {e}")
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def run(self):
+        logger.info("Database writer thread running")
+
+        while True:
+            batch = self._collect()
+            self.status = "running"
+            started = time.monotonic()
+            self._commit(batch)
+            logger.debug(f"Committed {len(batch)} database writes in {time.monotonic() - started:.3f}s")
+            if self._queue.empty():
+                self.status = "waiting"
@@ -1,86 +1,273 @@
+import hashlib
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
 from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlparse
+from datetime import datetime
 import time
 
 import requests
 
-from modules import config
+from modules import config, http_client, retry
+from modules.database import CatalogCache, write
 from modules.jwt import authorized_request
 from modules.jwt_quick import unauthorized_request
+from modules.manifest import PageManifest
 from modules.utils import get_fw_date
 
 logger = logging.getLogger(__name__)
 
-VALID_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0"
-
 PRESSREADER_BASE_URL = "https://ingress.pressreader.com/services/"
 PRESSREADER_CDN_URL = "https://i.prcdn.co/img"
 
 GET_PAGE_KEYS_ENDPOINT = "IssueInfo/GetPageKeys"
 GET_ISSUE_INFO_ENDPOINT = "catalog/v2/publications/"
 
-RETRY_DELAY = 5
+CHUNK_SIZE = 64 * 1024
+PART_SUFFIX = ".part"
+
+_host_slots: dict[str, BoundedSemaphore] = {}
+_host_slots_lock = Lock()
+
+def _get_host_slot(url: str) -> BoundedSemaphore:
+    """Return the semaphore limiting in-flight requests to the host of url"""
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = BoundedSemaphore(config.MAX_REQUESTS_PER_HOST)
+            _host_slots[host] = slot
+        return slot
 
-def _download_image(issue_number: str, scale: int, page_number: int, key: str, image_path: Path) -> bytes | None:
-    """Download a single page image"""
-    if image_path.exists():
-        logger.debug(f"Image for page {page_number} already exists at {image_path}, skipping download.")
-        with open(image_path, "rb") as f:
-            return f.read()
+def _close_page(response: requests.Response):
+    """Close a page response returned by _request_page, freeing its host slot"""
+    try:
+        response.close()
+    finally:
+        _get_host_slot(PRESSREADER_CDN_URL).release()
+
+def _request_page(issue_number: str, scale: int, page_number: int, key: str) -> requests.Response | None:
+    """Request a single page image at the given scale, retrying on server errors.
 
+    Retries follow retry.default_policy and all requests wait on the CDN circuit breaker.
+    Returns the response if it succeeded or was rejected with a 403, None otherwise.
+    A returned response keeps its CDN host slot until the body is read: it must be passed
+    to _save_response() or _close_page().
+    """
     url = PRESSREADER_CDN_URL
-    current_scale = scale
-    retries = 0
-    
-    while current_scale >= config.MIN_SCALE:
-        params = {
-            "file": issue_number,
-            "page": page_number,
-            "scale": str(current_scale),
-            "ticket": key,
-        }
-        
-        headers = { "User-Agent": VALID_USER_AGENT }
-        
-        while retries < config.MAX_RETRIES:
-            try:
-                logger.debug(f"GET {url}?{'&'.join(f'{k}={v}' for k,v in params.items())}")
-                response = requests.get(url, params=params, headers=headers)
-                
-                if response.status_code == 500:
-                    retries += 1
-                    logger.warning(f"500 error for page {page_number}, retrying ({retries}/{config.MAX_RETRIES})...")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                    
-                if response.status_code == 403:
-                    
-                    current_scale -= config.SCALE_STEP
-                    logger.warning(f"403 error for page {page_number}, retrying with lower scale: {current_scale}")
-                    retries = 0
-                    break
-                    
-                if not response.ok:
+    params = {
+        "file": issue_number,
+        "page": page_number,
+        "scale": str(scale),
+        "ticket": key,
+    }
+    policy = retry.default_policy
+    breaker = retry.get_breaker(urlparse(url).netloc)
+    slot = _get_host_slot(url)
+    attempt = 0
+
+    while True:
+        breaker.wait()
+        response = None
+        # The slot covers the whole request, body included, but not the backoff between attempts
+        slot.acquire()
+        keep_slot = False
+        try:
+            logger.debug(f"GET {url}?{'&'.join(f'{k}={v}' for k,v in params.items())}")
+            response = http_client.get(url, params=params, stream=True)
+
+            if response.status_code in retry.RETRYABLE_STATUS_CODES:
+                response.close()
+                breaker.record_failure()
+                error = f"{response.status_code} error"
+            else:
+                breaker.record_success()
+                if response.status_code != 403 and not response.ok:
+                    response.close()
                     logger.error(f"Failed to download image for page {page_number}. Status code: {response.status_code}")
                     return None
+                keep_slot = True
+                return response
+
+        except Exception as e:
+            breaker.record_failure()
+            error = f"Exception ({e})"
+        finally:
+            if not keep_slot:
+                slot.release()
 
-                with open(image_path, "wb") as f:
-                    f.write(response.content)
-                    
-                logger.debug(f"Downloaded page {page_number}")
-                return response.content
-                
-            except Exception as e:
-                logger.error(f"Exception downloading page {page_number}: {e}")
-                retries += 1
-                
-        if retries >= config.MAX_RETRIES:
-            logger.error(f"Max retries reached for page {page_number} (500 error)")
+        attempt += 1
+        if not policy.should_retry(attempt):
+            logger.error(f"Max retries reached for page {page_number} ({error})")
             return None
-    
+
+        delay = policy.get_delay(attempt, response)
+        logger.warning(f"{error} for page {page_number}, retrying in {delay:.1f}s ({attempt}/{policy.max_retries})...")
+        time.sleep(delay)
+
+def _save_response(response: requests.Response, image_path: Path) -> tuple[int, str]:
+    """Stream a response body to image_path, replacing it only once fully written.
+    The response is closed, and its host slot freed, in any case.
+
+    Returns the size in bytes and the sha256 checksum of the saved file.
+    """
+    part_path = image_path.with_suffix(image_path.suffix + PART_SUFFIX)
+    checksum = hashlib.sha256()
+    size = 0
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+        os.replace(part_path, image_path)
+    finally:
+        _close_page(response)
+        part_path.unlink(missing_ok=True)
+    return size, checksum.hexdigest()
+
+def _download_image(issue_number: str, scale: int, page_number: int, key: str, image_path: Path, manifest: PageManifest) -> Path | None:
+    """Download a single page image to image_path, recording it in the manifest"""
+    if manifest.is_complete(page_number, image_path):
+        logger.debug(f"Image for page {page_number} already downloaded at {image_path}, skipping download.")
+        return image_path
+
+    current_scale = scale
+
+    while current_scale >= config.MIN_SCALE:
+        response = _request_page(issue_number, current_scale, page_number, key)
+        if response is None:
+            manifest.mark_failed(page_number)
+            return None
+
+        if response.status_code == 403:
+            _close_page(response)
+            current_scale -= config.SCALE_STEP
+            logger.warning(f"403 error for page {page_number}, retrying with lower scale: {current_scale}")
+            continue
+
+        try:
+            size, checksum = _save_response(response, image_path)
+        except Exception as e:
+            logger.error(f"Exception saving page {page_number}: {e}")
+            manifest.mark_failed(page_number)
+            return None
+
+        manifest.mark_done(page_number, current_scale, image_path, size, checksum)
+        logger.debug(f"Downloaded page {page_number}")
+        return image_path
+
     logger.error(f"403 error for page {page_number}, minimum scale reached")
+    manifest.mark_failed(page_number)
     return None
 
+def _get_page_jobs(page_keys: list[dict[str,str]]) -> list[tuple[int, str]]:
+    """Return (page number, page key) pairs sorted by page number, skipping pages without a key"""
+    page_keys = sorted(page_keys, key=lambda x: x.get("PageNumber", 0))
+
+    jobs: list[tuple[int, str]] = []
+    for index, page in enumerate(page_keys):
+        page_number = int(page.get("PageNumber") or index + 1)
+        page_key = page.get("Key")
+        if page_key is None:
+            logger.warning(f"Skipping page {page_number} with missing Key.")
+            continue
+        jobs.append((page_number, page_key))
+    return jobs
+
+def find_scale(key: str, max_scale: int, learned_scale: int | None, page_keys: list[dict[str,str]], path: Path) -> int | None:
+    """Find the highest scale the CDN accepts for an issue using its first page.
+
+    The previously learned scale (or max_scale) is tried first, then the range down to
+    MIN_SCALE is binary searched in SCALE_STEP increments. A learned scale below max_scale
+    may come from a transient rejection, so one step above it is probed before it, letting
+    the learned scale climb back up. The first page is saved to path (and its manifest) at
+    the scale found, so download_issue() does not fetch it again. If the manifest already
+    holds the first page at one of the scales probed first, no request is made at all.
+
+    Args:
+        key: Issue key from FileWorkflow.
+        max_scale: Highest scale allowed for the publication.
+        learned_scale: Highest scale that succeeded last time, if any.
+        page_keys: List of page key dictionaries as returned by get_page_keys().
+        path: Path to save images to.
+
+    Returns:
+        The scale found, or None if the first page could not be downloaded at any scale.
+    """
+    jobs = _get_page_jobs(page_keys)
+    if not jobs:
+        return None
+    page_number, page_key = jobs[0]
+    image_path = path / f"{page_number}.jpg"
+    manifest = PageManifest.load(path)
+
+    upper = min(learned_scale or max_scale, max_scale)
+    raised = min(upper + config.SCALE_STEP, max_scale) if upper < max_scale else None
+    entry = manifest.get(page_number)
+    if manifest.is_complete(page_number, image_path) and entry and entry.get("scale") in (upper, raised):
+        logger.debug(f"Page {page_number} already downloaded at scale {entry['scale']}")
+        return int(entry["scale"])
+
+    candidates = list(range(upper, config.MIN_SCALE - 1, -config.SCALE_STEP))
+    candidates.reverse()
+
+    def probe(scale: int) -> bool | None:
+        response = _request_page(key, scale, page_number, page_key)
+        if response is None:
+            return None
+        if response.status_code == 403:
+            _close_page(response)
+            logger.debug(f"Scale {scale} rejected for page {page_number}")
+            return False
+        # Accepted scales only grow during the search, so the last image saved is the best one
+        try:
+            size, checksum = _save_response(response, image_path)
+        except Exception as e:
+            logger.error(f"Exception saving page {page_number}: {e}")
+            return None
+        manifest.mark_done(page_number, scale, image_path, size, checksum)
+        return True
+
+    if raised is not None:
+        accepted = probe(raised)
+        if accepted is None:
+            return None
+        if accepted:
+            logger.info(f"Scale {raised} accepted again for issue {key} (learned {upper}, max {max_scale})")
+            return raised
+
+    # The upper bound is usually still valid, so try it before searching
+    accepted = probe(upper)
+    if accepted is None:
+        return None
+    if accepted:
+        return upper
+
+    best: int | None = None
+    lo, hi = 0, len(candidates) - 2
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        accepted = probe(candidates[mid])
+        if accepted is None:
+            return None
+        if accepted:
+            best = candidates[mid]
+            lo = mid + 1
+        else:
+            hi = mid - 1
+
+    if best is None:
+        logger.error(f"403 error for page {page_number}, minimum scale reached")
+        return None
+
+    logger.info(f"Found scale {best} (max {max_scale}) for issue {key}")
+    return best
+
 
 def get_page_keys(issue_key: str) -> tuple[list[dict[str,str]], int]:
     """Get page keys for an issue"""
@@ -109,41 +296,92 @@ def get_page_keys(issue_key: str) -> tuple[list[dict[str,str]], int]:
         logger.error(f"Exception getting page keys: {e}")
         return [], 500
 
+def _store_issue_info(issue_id: str, cached: CatalogCache | None, response: requests.Response):
+    """Queue the save of a catalog response on the database writer,
+    keeping the row untouched apart from fetched_at if the content did not change"""
+    body = response.text
+    content_hash = hashlib.sha256(body.encode()).hexdigest()
+    values = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+        "body": body,
+        "fetched_at": datetime.now(),
+    }
+
+    if cached is None:
+        write(CatalogCache.create, issue_id=issue_id, **values)
+    elif cached.content_hash == content_hash:
+        logger.debug(f"Issue info for issue ID {issue_id} unchanged")
+        write(CatalogCache.update(fetched_at=values["fetched_at"], etag=values["etag"], last_modified=values["last_modified"]).where(CatalogCache.id == cached.id).execute)
+    else:
+        write(CatalogCache.update(**values).where(CatalogCache.id == cached.id).execute)
+
 def get_issue_info(issue_id: str) -> dict | None:
-    """Get issue info for a publication"""
+    """Get issue info for a publication.
+
+    Responses are cached in the database: within CATALOG_CACHE_TTL the cached document
+    is returned without a request, afterwards it is revalidated with ETag/Last-Modified
+    when the API supplied them.
+    """
     url = PRESSREADER_BASE_URL + GET_ISSUE_INFO_ENDPOINT + issue_id
     params = {}
 
     try:
+        cached = CatalogCache.get_or_none(CatalogCache.issue_id == issue_id)
+        if cached is not None:
+            age = (datetime.now() - cached.fetched_at).total_seconds()
+            if age < config.CATALOG_CACHE_TTL:
+                logger.debug(f"Using cached issue info for issue ID {issue_id}")
+                return json.loads(str(cached.body))
+
+        headers: dict[str,str] = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = str(cached.etag)
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = str(cached.last_modified)
+
         logger.debug(f"Getting issue info for issue ID {issue_id}")
-        response = unauthorized_request(url, params)
+        response = unauthorized_request(url, params, headers)
+
+        if response.status_code == 304 and cached is not None:
+            logger.debug(f"Issue info for issue ID {issue_id} not modified")
+            write(CatalogCache.update(fetched_at=datetime.now()).where(CatalogCache.id == cached.id).execute)
+            return json.loads(str(cached.body))
 
         if not response.ok:
             logger.error(f"Error in request: {response.status_code}")
             return None
 
-        return response.json()
+        info = response.json()
+        try:
+            _store_issue_info(issue_id, cached, response)
+        except Exception as e:
+            logger.warning(f"Failed to cache issue info for issue ID {issue_id}: {e}")
+        return info
     except Exception as e:
         logger.error(f"Exception getting issue info: {e}")
         return None
-    #
 
-def download_issue(name: str, key: str, max_scale: int, page_keys: list[dict[str,str]], path: Path) -> list[bytes]:
+def download_issue(name: str, key: str, max_scale: int, page_keys: list[dict[str,str]], path: Path, on_page: Callable[[int, Path], None] | None = None) -> list[Path]:
     """Download all page images for a given issue.
 
+    Pages are fetched concurrently (up to MAX_REQUESTS_PER_HOST in flight) and
+    returned sorted by page number. Pages already recorded as done in the folder's
+    manifest are reused, so an interrupted download resumes where it left off.
+
     Args:
         name: Human-friendly publication name (used for logs only).
         key: Issue key from FileWorkflow.
-        max_scale: Preferred scale (will step down on 403).
+        max_scale: Preferred scale, usually found with find_scale() (will step down on 403).
         page_keys: List of page key dictionaries as returned by get_page_keys().
         path: Path to save images to.
+        on_page: Optional callback invoked with (page number, image path) as soon as each page is on disk.
 
     Returns:
-        List of bytes objects containing image bytes for each successfully downloaded page.
+        List of image paths, one for each successfully downloaded page.
     """
 
-    images: list[bytes] = []
-
     l = len(page_keys)
     logging.debug(f"Issue has {l} pages.")
 
@@ -151,22 +389,29 @@ def download_issue(name: str, key: str, max_scale: int, page_keys: list[dict[str
         logger.warning("Issue has less than 2 pages.")
         return []
 
-    page_keys = sorted(page_keys, key=lambda x: x.get("PageNumber", 0))
+    jobs = _get_page_jobs(page_keys)
+    manifest = PageManifest.load(path)
 
-    for index, page in enumerate(page_keys):
-        page_number = int(page.get("PageNumber") or index + 1)
-        page_key = page.get("Key")
-        if page_key is None:
-            logger.warning(f"Skipping page {page_number} with missing Key.")
-            continue
+    results: dict[int, Path] = {}
+    with ThreadPoolExecutor(max_workers=config.MAX_REQUESTS_PER_HOST, thread_name_prefix="PageFetcher") as executor:
+        futures = {
+            executor.submit(_download_image, key, max_scale, page_number, page_key, path / f"{page_number}.jpg", manifest): page_number
+            for page_number, page_key in jobs
+        }
+        for future in as_completed(futures):
+            page_number = futures[future]
+            image_path = future.result()
+            if image_path is None:
+                logger.warning(f"Failed to download page {page_number}.")
+                for pending in futures:
+                    pending.cancel()
+                return []
+            results[page_number] = image_path
+            if on_page is not None:
+                on_page(page_number, image_path)
 
-        image_path = path / f"{page_number}.jpg"
-        img_bytes = _download_image(key, max_scale, page_number, page_key, image_path)
-        if img_bytes:
-            images.append(img_bytes)
-        else:
-            logger.warning(f"Failed to download page {page_number}.")
-            return []
+    # img2pdf needs pages in reading order, regardless of completion order
+    images = [results[page_number] for page_number in sorted(results)]
 
     logger.info(f"Got {len(images)}/{len(page_keys)} pages for {name} ({get_fw_date(key)}).")
     return images
@@ -0,0 +1,51 @@
+import logging
+from pathlib import Path
+from threading import Event, Lock
+
+logger = logging.getLogger(__name__)
+
+STAGE_DOWNLOAD = "download"
+STAGE_OCR = "ocr"
+STAGE_UPLOAD = "upload"
+
+_events: dict[str, Event] = {
+    STAGE_DOWNLOAD: Event(),
+    STAGE_OCR: Event(),
+    STAGE_UPLOAD: Event(),
+}
+
+# Files handed to a stage since its last take()
+_ready: dict[str, set[Path]] = {stage: set() for stage in _events}
+_ready_lock = Lock()
+
+
+def notify(stage: str, path: Path | None = None):
+    """Wake the thread of a stage because new work is ready for it, optionally naming the ready file"""
+    logger.debug(f"Waking {stage} stage" + (f" for {path.name}" if path else ""))
+    if path is not None:
+        with _ready_lock:
+            _ready[stage].add(path)
+    _events[stage].set()
+
+
+def take(stage: str) -> set[Path]:
+    """Return and forget the files handed to a stage through notify()"""
+    with _ready_lock:
+        ready = _ready[stage]
+        _ready[stage] = set()
+    return ready
+
+
+def wait(stage: str, timeout: float) -> bool:
+    """
+    Block until the stage is notified or the timeout expires.
+    Work must be persisted before notify() is called, so a notification arriving
+    while the stage is busy simply makes the next wait() return immediately.
+
+    Returns:
+        True if woken by a notification, False on timeout.
+    """
+    event = _events[stage]
+    notified = event.wait(timeout)
+    event.clear()
+    return notified
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from modules import config
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+# Recently used entries are never evicted, they may be about to be served
+EVICTION_GRACE = 60
+# Least interval between eviction scans triggered by cache hits
+SCAN_INTERVAL = 60
+
+
+class FileCache:
+    """
+    On-disk cache of files fetched back from Telegram.
+    Entries are written through a partial file and renamed into place, so a cached path is
+    always complete. Entries unused for `max_age` seconds are dropped, and the least recently
+    used ones go once the cache grows past `max_bytes` (file mtimes record the last use).
+    Concurrent requests for the same missing entry share a single fetch.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int, max_age: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._fetches: dict[str, asyncio.Future] = {}
+        self._last_scan = 0.0
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        # Partial files left behind by an interrupted fetch
+        for partial in self.folder.glob("*" + PART_SUFFIX):
+            partial.unlink(missing_ok=True)
+
+    async def get(self, name: str, fetch: Callable[[Path], Awaitable[Path]]) -> Path:
+        """Return the cached file called name, calling fetch(partial_path) to create it on a miss.
+        fetch returns the path it actually wrote, which is then moved into the cache."""
+        path = self.folder / name
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        else:
+            self.hits += 1
+            if time.monotonic() - self._last_scan > SCAN_INTERVAL:
+                await asyncio.to_thread(self._evict)
+            return path
+
+        fetching = self._fetches.get(name)
+        if fetching is None:
+            self.misses += 1
+            # A task of its own, so a caller going away does not cancel the fetch for the others
+            fetching = asyncio.ensure_future(self._fetch(name, fetch))
+            self._fetches[name] = fetching
+            fetching.add_done_callback(lambda task: self._fetch_done(name, task))
+        else:
+            logger.debug(f"Waiting for the running fetch of {name}")
+            self.coalesced += 1
+        return await asyncio.shield(fetching)
+
+    async def _fetch(self, name: str, fetch: Callable[[Path], Awaitable[Path]]) -> Path:
+        path = self.folder / name
+        partial_path = self.folder / f"{name}.{uuid.uuid4().hex}{PART_SUFFIX}"
+        try:
+            written = await fetch(partial_path)
+            os.replace(written, path)
+        finally:
+            partial_path.unlink(missing_ok=True)
+        await asyncio.to_thread(self._evict)
+        return path
+
+    def _fetch_done(self, name: str, task: asyncio.Future):
+        del self._fetches[name]
+        # Retrieve the error, so a fetch whose callers all went away is not reported as unhandled
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to fetch {name}: {task.exception()}")
+
+    def _evict(self):
+        """Delete expired entries, then the least recently used ones until the cache fits the budget"""
+        self._last_scan = time.monotonic()
+        now = time.time()
+        entries = []
+        total = 0
+        for entry in self.folder.iterdir():
+            if entry.name.endswith(PART_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime < EVICTION_GRACE:
+                total += stat.st_size
+                continue
+            if now - stat.st_mtime > self.max_age:
+                entry.unlink(missing_ok=True)
+                logger.info(f"Evicted {entry.name} from the file cache (unused for {self.max_age}s)")
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            logger.info(f"Evicted {entry.name} from the file cache (over {self.max_bytes} bytes)")
+
+    def to_dict(self) -> dict:
+        size = 0
+        files = 0
+        for entry in self.folder.iterdir():
+            if entry.name.endswith(PART_SUFFIX):
+                continue
+            try:
+                size += entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            files += 1
+        return {
+            "files": files,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "fetching": len(self._fetches),
+        }
+
+
+_cache: FileCache | None = None
+
+
+def get_file_cache() -> FileCache:
+    """Return the cache of files fetched back from Telegram"""
+    global _cache
+
+    if _cache is None:
+        _cache = FileCache(
+            config.TELEGRAM_CACHE_FOLDER,
+            config.TELEGRAM_CACHE_SIZE_MB * 1024 * 1024,
+            config.TELEGRAM_CACHE_MAX_AGE,
+        )
+    return _cache
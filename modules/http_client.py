@@ -0,0 +1,87 @@
+import logging
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules import config
+
+logger = logging.getLogger(__name__)
+
+VALID_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:145.0) Gecko/20100101 Firefox/145.0"
+
+_session = None
+_session_lock = Lock()
+
+
+class _PooledSession(requests.Session):
+    """Session that applies the configured timeout to every request"""
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", config.HTTP_TIMEOUT)
+        return super().request(method, url, *args, **kwargs)
+
+
+def _create_session() -> _PooledSession:
+    session = _PooledSession()
+    session.headers.update({"User-Agent": VALID_USER_AGENT})
+
+    # One pool per host, sized so every concurrent caller keeps its own connection alive:
+    # CDN page fetches are capped at MAX_REQUESTS_PER_HOST by the download slots, while the
+    # API host serves the catalog pollers and the downloader workers fetching page keys
+    adapter = HTTPAdapter(
+        pool_connections=config.MAX_REQUESTS_PER_HOST,
+        pool_maxsize=max(config.MAX_REQUESTS_PER_HOST, config.CATALOG_WORKERS + config.DOWNLOAD_WORKERS),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Thread-safe access to the shared HTTP session.
+    Connections are kept alive and reused across all callers.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            logger.debug("Creating shared HTTP session")
+            _session = _create_session()
+        return _session
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """GET through the shared session"""
+    return get_session().get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """POST through the shared session"""
+    return get_session().post(url, **kwargs)
+
+
+def get_pool_stats() -> list[dict]:
+    """Return connection reuse statistics for each host pool"""
+    adapter = get_session().get_adapter("https://")
+    pools = adapter.poolmanager.pools
+
+    stats = []
+    for pool_key in list(pools.keys()):
+        pool = pools.get(pool_key)
+        if pool is None:
+            continue
+
+        requests_count = pool.num_requests
+        connections = pool.num_connections
+        reused = max(requests_count - connections, 0)
+        stats.append({
+            "host": pool.host,
+            "scheme": pool.scheme,
+            "requests": requests_count,
+            "connections": connections,
+            "idle_connections": pool.pool.qsize() if pool.pool else 0,
+            "reuse_rate": round(reused / requests_count, 3) if requests_count else 0.0,
+        })
+    return stats
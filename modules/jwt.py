@@ -8,7 +8,7 @@ from threading import Lock
 from playwright.sync_api import Page, Response, TimeoutError, sync_playwright
 import requests
 
-from modules import config
+from modules import config, http_client
 
 logger = logging.getLogger(__name__)
 
@@ -236,19 +236,20 @@ def invalidate_jwt():
         logger.info("JWT cache invalidated")
 
 
-def authorized_request(url: str, params: dict[str,str]) -> requests.Response:
+def authorized_request(url: str, params: dict[str,str], extra_headers: dict[str,str] | None = None) -> requests.Response:
     """Make an authorized GET request with JWT, invalidate on 401"""
     jwt = get_jwt()
     headers = {
+        **(extra_headers or {}),
         "Authorization": f"Bearer {jwt}",
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = http_client.get(url, headers=headers, params=params)
     if response.status_code == 401:
         logger.info("JWT expired, obtaining a new one...")
         invalidate_jwt()
         jwt = get_jwt()
         headers["Authorization"] = f"Bearer {jwt}"
-        response = requests.get(url, headers=headers, params=params)
+        response = http_client.get(url, headers=headers, params=params)
     return response
 
 
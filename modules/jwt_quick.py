@@ -3,7 +3,7 @@ from threading import Lock
 
 import requests
 
-from modules import config
+from modules import config, http_client
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +24,7 @@ def _get_jwt_logic() -> str:
         "urlReferrer": "",
         "url": f"{PRESSREADER_URL}/{PRESSREADER_LANGUAGE}{PRESSREADER_CATALOG_ENDPOINT}",
     }
-    response = requests.post(url, json=data)
+    response = http_client.post(url, json=data)
     response.raise_for_status()
     json_data = response.json()
     bearer_token = json_data.get("bearerToken", "")
@@ -75,17 +75,18 @@ def invalidate_jwt():
         logger.info("JWT cache invalidated")
 
 
-def unauthorized_request(url: str, params: dict[str,str]) -> requests.Response:
+def unauthorized_request(url: str, params: dict[str,str], extra_headers: dict[str,str] | None = None) -> requests.Response:
     """Make an authorized GET request with JWT, invalidate on 401"""
     jwt = get_jwt()
     headers = {
+        **(extra_headers or {}),
         "Authorization": f"Bearer {jwt}",
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = http_client.get(url, headers=headers, params=params)
     if response.status_code == 401:
         logger.info("JWT expired, obtaining a new one...")
         invalidate_jwt()
         jwt = get_jwt()
         headers["Authorization"] = f"Bearer {jwt}"
-        response = requests.get(url, headers=headers, params=params)
+        response = http_client.get(url, headers=headers, params=params)
     return response
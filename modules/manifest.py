@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class PageManifest:
+    """
+    Per-issue record of downloaded pages, stored as manifest.json in the images folder.
+    Each page entry holds the scale used, byte size, mtime, sha256 checksum and state.
+    The file is rewritten atomically after every change, so it can be trusted after a crash.
+    """
+
+    def __init__(self, path: Path, pages: dict[str, dict] | None = None):
+        self.path = path
+        self.pages: dict[str, dict] = pages or {}
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> "PageManifest":
+        """Load the manifest of an images folder, starting empty if missing or unreadable"""
+        manifest_file = path / MANIFEST_FILENAME
+        if not manifest_file.exists():
+            return cls(path)
+
+        try:
+            with open(manifest_file, "r") as f:
+                data = json.load(f)
+            return cls(path, data.get("pages", {}))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable manifest {manifest_file}: {e}")
+            return cls(path)
+
+    def get(self, page_number: int) -> dict | None:
+        with self._lock:
+            return self.pages.get(str(page_number))
+
+    def is_complete(self, page_number: int, image_path: Path) -> bool:
+        """Whether a page was fully downloaded and its file still matches the recorded size and mtime.
+        The file is only hashed and compared to the recorded checksum if its mtime changed."""
+        entry = self.get(page_number)
+        if entry is None or entry.get("state") != STATE_DONE:
+            return False
+        try:
+            stat = image_path.stat()
+            if stat.st_size != entry.get("size"):
+                return False
+            if stat.st_mtime_ns == entry.get("mtime_ns"):
+                return True
+            if _sha256(image_path) != entry.get("sha256"):
+                logger.warning(f"Checksum mismatch for {image_path}, downloading it again")
+                return False
+            return True
+        except FileNotFoundError:
+            return False
+
+    def mark_done(self, page_number: int, scale: int, image_path: Path, size: int, checksum: str):
+        self._update(page_number, {
+            "state": STATE_DONE,
+            "scale": scale,
+            "size": size,
+            "mtime_ns": image_path.stat().st_mtime_ns,
+            "sha256": checksum,
+        })
+
+    def mark_failed(self, page_number: int):
+        self._update(page_number, {"state": STATE_FAILED})
+
+    def _update(self, page_number: int, entry: dict):
+        entry["updated_at"] = datetime.now().isoformat()
+        with self._lock:
+            self.pages[str(page_number)] = entry
+            self._save()
+
+    def _save(self):
+        manifest_file = self.path / MANIFEST_FILENAME
+        temp_file = manifest_file.with_suffix(".tmp")
+        with open(temp_file, "w") as f:
+            json.dump({"pages": self.pages}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, manifest_file)
+
+
+def _sha256(path: Path) -> str:
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHECKSUM_CHUNK_SIZE):
+            checksum.update(chunk)
+    return checksum.hexdigest()
@@ -0,0 +1,174 @@
+import logging
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from threading import Lock
+
+import img2pdf
+import ocrmypdf
+import pikepdf
+
+from modules import config
+
+logger = logging.getLogger(__name__)
+
+# ocrmypdf output optimization profiles, trading OCR time for output size
+# "small" needs pngquant (installed in the Docker image); with jbig2enc on the PATH
+# it also JBIG2-compresses monochrome images, otherwise ocrmypdf skips that step
+OCR_PROFILES: dict[str, dict] = {
+    "fast": {"optimize": 0},
+    "balanced": {"optimize": 1},
+    "small": {"optimize": 3, "jpg_quality": 60},
+}
+
+# ocrmypdf options for single pages; part of the OCR cache key, so cached pages follow any change
+PAGE_OCR_OPTIONS = {
+    "skip_text": True,
+    "jobs": 1,
+}
+
+
+def get_profile_options(profile: str | None) -> dict:
+    """Return the ocrmypdf options of a profile, falling back to OCR_PROFILE for unknown names"""
+    if profile not in OCR_PROFILES:
+        profile = config.OCR_PROFILE
+    return OCR_PROFILES.get(profile or "", OCR_PROFILES["fast"])
+
+
+def run_ocr(input_path: Path, output_path: Path, language: str, jobs: int, profile: str | None = None) -> int:
+    """Run ocrmypdf on a single PDF. Executed inside an OCR pool worker process.
+
+    Returns:
+        ocrmypdf exit code (0 on success)
+    """
+    warnings.filterwarnings("ignore")
+    exit_code = ocrmypdf.ocr(
+        input_path,
+        output_path,
+        skip_text=True,
+        quiet=True,
+        progress_bar=False,
+        language=language,
+        jobs=jobs,
+        **get_profile_options(profile),
+    )
+    return int(exit_code)
+
+
+def ocr_page(image_path: Path, output_path: Path, language: str, profile: str | None = None) -> int:
+    """OCR a single page image into a single-page PDF. Executed inside an OCR pool worker process.
+
+    The output is written through a partial file, so an existing output_path is always complete.
+    """
+    warnings.filterwarnings("ignore")
+    page_pdf = output_path.with_name(output_path.name + ".img.part")
+    partial_path = output_path.with_name(output_path.name + ".part")
+    try:
+        with open(page_pdf, "wb") as f:
+            img2pdf.convert(str(image_path), outputstream=f)
+        exit_code = ocrmypdf.ocr(
+            page_pdf,
+            partial_path,
+            quiet=True,
+            progress_bar=False,
+            language=language,
+            **PAGE_OCR_OPTIONS,
+            **get_profile_options(profile),
+        )
+        if exit_code == 0:
+            os.replace(partial_path, output_path)
+        return int(exit_code)
+    finally:
+        page_pdf.unlink(missing_ok=True)
+        partial_path.unlink(missing_ok=True)
+
+
+def merge_pages(page_paths: list[Path], output_path: Path):
+    """Concatenate single-page PDFs into output_path, replacing it only once fully written"""
+    partial_path = output_path.with_name(output_path.name + ".part")
+    sources: list[pikepdf.Pdf] = []
+    try:
+        with pikepdf.Pdf.new() as merged:
+            for page_path in page_paths:
+                source = pikepdf.open(page_path)
+                sources.append(source)
+                merged.pages.extend(source.pages)
+            merged.save(partial_path)
+        os.replace(partial_path, output_path)
+    finally:
+        for source in sources:
+            source.close()
+        partial_path.unlink(missing_ok=True)
+
+
+def images_to_pdf(image_paths: list[Path], output_path: Path):
+    """Convert page images into one PDF a page at a time, so only one image is held in memory"""
+    page_paths: list[Path] = []
+    try:
+        for image_path in image_paths:
+            page_pdf = image_path.with_name(image_path.name + ".pdf.part")
+            page_paths.append(page_pdf)
+            with open(page_pdf, "wb") as f:
+                img2pdf.convert(str(image_path), outputstream=f)
+        merge_pages(page_paths, output_path)
+    finally:
+        for page_pdf in page_paths:
+            page_pdf.unlink(missing_ok=True)
+
+
+class OCRExecutor:
+    """
+    Process pool running several ocrmypdf jobs at once.
+    Each file gets `jobs_per_file` ocrmypdf workers, so the total core usage is
+    workers * jobs_per_file; by default the cores are split evenly between files.
+    """
+
+    def __init__(self, workers: int, jobs_per_file: int = 0):
+        self.workers = workers
+        self.jobs_per_file = jobs_per_file or max(1, (os.cpu_count() or 1) // workers)
+        self._lock = Lock()
+        self._pool = self._create_pool()
+        logger.info(f"OCR executor using {self.workers} processes with {self.jobs_per_file} jobs each")
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        # Forking a process that runs several threads is unsafe, always start fresh interpreters
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _submit(self, fn, *args) -> Future:
+        """Queue a call on the pool, recreating the pool if a worker died"""
+        with self._lock:
+            try:
+                return self._pool.submit(fn, *args)
+            except BrokenProcessPool:
+                logger.warning("OCR process pool broken, restarting it")
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._create_pool()
+                return self._pool.submit(fn, *args)
+
+    def submit(self, input_path: Path, output_path: Path, language: str, profile: str | None = None) -> Future:
+        """Queue a whole PDF for OCR"""
+        return self._submit(run_ocr, input_path, output_path, language, self.jobs_per_file, profile)
+
+    def submit_page(self, image_path: Path, output_path: Path, language: str, profile: str | None = None) -> Future:
+        """Queue a single page image for OCR into a single-page PDF"""
+        return self._submit(ocr_page, image_path, output_path, language, profile)
+
+
+_executor: OCRExecutor | None = None
+_executor_lock = Lock()
+
+
+def get_executor() -> OCRExecutor:
+    """Return the OCR executor shared by the downloader and OCR threads"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = OCRExecutor(config.OCR_WORKERS, config.OCR_JOBS)
+        return _executor
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from threading import Lock
+
+import ocrmypdf
+import pikepdf
+
+from modules import config
+from modules.ocr import PAGE_OCR_OPTIONS, get_profile_options
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Sidecar of a PDF waiting for OCR, listing the cache keys of its pages
+KEYS_SUFFIX = ".keys.json"
+
+
+class OCRCache:
+    """
+    Content-addressed cache of OCR'd single-page PDFs.
+    Entries are keyed by the page image bytes, the OCR language and the ocrmypdf
+    settings; the least recently used entries are evicted once the cache grows
+    past `max_bytes` (file mtimes record the last use).
+    """
+
+    def __init__(self, folder: Path, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Total size of the cache, computed by the first scan and then tracked on put()
+        self._size: int | None = None
+        self._lock = Lock()
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def get_key(image_path: Path, language: str, profile: str | None = None) -> str:
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest.update(language.encode())
+        options = {**PAGE_OCR_OPTIONS, **get_profile_options(profile)}
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        digest.update(ocrmypdf.__version__.encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.folder / key[:2] / f"{key}.pdf"
+
+    def get(self, key: str, output_path: Path) -> bool:
+        """Copy the cached page for key to output_path. Returns False on a miss.
+        The copy goes through a partial file, so an existing output_path is always complete."""
+        entry = self._entry_path(key)
+        partial_path = output_path.with_name(output_path.name + ".part")
+        try:
+            shutil.copyfile(entry, partial_path)
+            os.replace(partial_path, output_path)
+            os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        finally:
+            partial_path.unlink(missing_ok=True)
+
+        self.hits += 1
+        return True
+
+    def put(self, key: str, page_pdf: Path):
+        """Store an OCR'd page, then evict old entries if the cache is over budget"""
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = entry.with_name(entry.name + ".part")
+        try:
+            shutil.copyfile(page_pdf, partial_path)
+            os.replace(partial_path, entry)
+        finally:
+            partial_path.unlink(missing_ok=True)
+        self._added(entry)
+
+    def put_pages(self, keys: list[str], document: Path):
+        """Store every page of an OCR'd document under the key of its page image"""
+        with pikepdf.open(document) as pdf:
+            if len(pdf.pages) != len(keys):
+                logger.warning(f"Not caching {document.name}: {len(pdf.pages)} pages for {len(keys)} keys")
+                return
+            for key, page in zip(keys, pdf.pages):
+                entry = self._entry_path(key)
+                if entry.exists():
+                    continue
+                entry.parent.mkdir(parents=True, exist_ok=True)
+                partial_path = entry.with_name(entry.name + ".part")
+                try:
+                    with pikepdf.Pdf.new() as single:
+                        single.pages.append(page)
+                        single.save(partial_path)
+                    os.replace(partial_path, entry)
+                finally:
+                    partial_path.unlink(missing_ok=True)
+                self._added(entry)
+
+    def _added(self, entry: Path):
+        """Account for a new entry, evicting old ones if the cache is over budget"""
+        with self._lock:
+            if self._size is not None:
+                self._size += entry.stat().st_size
+            if self._size is None or self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Scan the cache and delete the least recently used entries until it fits the budget"""
+        entries = []
+        total = 0
+        for entry in self.folder.glob("*/*.pdf"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+            logger.debug(f"OCR cache evicted down to {total} bytes")
+
+        self._size = total
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            if self._size is None:
+                self._evict()
+            size = self._size
+        return {
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def get_keys_path(document: Path) -> Path:
+    return document.with_name(document.name + KEYS_SUFFIX)
+
+
+def save_keys(document: Path, keys: list[str]):
+    """Record the cache keys of the pages of a PDF waiting for OCR"""
+    keys_path = get_keys_path(document)
+    partial_path = keys_path.with_name(keys_path.name + ".part")
+    with open(partial_path, "w") as f:
+        json.dump(keys, f)
+    os.replace(partial_path, keys_path)
+
+
+def load_keys(document: Path) -> list[str] | None:
+    """Return the cache keys recorded by save_keys, or None if there are none"""
+    try:
+        with open(get_keys_path(document), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+_cache: OCRCache | None = None
+_cache_lock = Lock()
+
+
+def get_cache() -> OCRCache:
+    """Return the shared OCR page cache"""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = OCRCache(config.OCR_CACHE_FOLDER, config.OCR_CACHE_SIZE_MB * 1024 * 1024)
+        return _cache
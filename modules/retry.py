@@ -0,0 +1,159 @@
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Condition, Lock
+
+import requests
+
+from modules import config
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honoring Retry-After headers"""
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt: int) -> bool:
+        """Whether another attempt is allowed after `attempt` failed ones"""
+        return attempt < self.max_retries
+
+    def get_delay(self, attempt: int, response: requests.Response | None = None) -> float:
+        """Seconds to wait before the next attempt (attempt starts at 1)"""
+        retry_after = _parse_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+def _parse_retry_after(response: requests.Response) -> float | None:
+    """Return the Retry-After header in seconds, accepting both delta-seconds and HTTP dates"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+    After `failure_threshold` consecutive failures the circuit opens and every caller
+    of wait() blocks for `cooldown` seconds; then a single caller is let through to
+    probe the host, and the circuit closes again on its success.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # When the running half-open probe was handed out, None if there is none
+        self.probe_started: float | None = None
+        self._condition = Condition()
+
+    def wait(self):
+        """Block until requests to the host are allowed"""
+        with self._condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return
+
+                if self.state == self.OPEN:
+                    remaining = self.opened_at + self.cooldown - time.monotonic()
+                    if remaining <= 0:
+                        logger.info(f"Circuit for {self.name} half-open, probing host")
+                        self.state = self.HALF_OPEN
+                        self.probe_started = time.monotonic()
+                        return
+                    self._condition.wait(remaining)
+                    continue
+
+                # Half-open: another caller is probing, wait for its outcome
+                if self.probe_started is None or time.monotonic() - self.probe_started >= self.cooldown:
+                    # No probe, or it never reported back; hand the probe to this caller only
+                    self.probe_started = time.monotonic()
+                    return
+                self._condition.wait(self.probe_started + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        with self._condition:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probe_started = None
+            self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            if self.state == self.OPEN:
+                # Late failure of a request sent before the circuit opened; keep the cooldown as it is
+                return
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                logger.warning(f"Circuit for {self.name} open after {self.failures} failures, pausing for {self.cooldown}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+                self._condition.notify_all()
+
+    def to_dict(self) -> dict:
+        with self._condition:
+            return {
+                "host": self.name,
+                "state": self.state,
+                "failures": self.failures,
+            }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = Lock()
+
+default_policy = RetryPolicy(
+    max_retries=config.MAX_RETRIES,
+    base_delay=config.RETRY_BASE_DELAY,
+    max_delay=config.RETRY_MAX_DELAY,
+)
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Return the shared circuit breaker for a host"""
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, config.BREAKER_THRESHOLD, config.BREAKER_COOLDOWN)
+            _breakers[host] = breaker
+        return breaker
+
+
+def get_breaker_states() -> list[dict]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.to_dict() for breaker in breakers]
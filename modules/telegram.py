@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from datetime import datetime
 from pathlib import Path
 from telethon import TelegramClient
 from telethon.sessions import StringSession
@@ -68,8 +70,79 @@ async def create_telegram_client() -> TelegramClient:
     return client
 
 
+class SharedTelegramClient:
+    """
+    Telegram client kept connected for the lifetime of an event loop and shared by all its callers,
+    so requests skip the connect and authorization handshake. Telethon multiplexes concurrent
+    requests over the connection and reconnects on its own after network errors; a client
+    that still ended up disconnected is reconnected on the next get().
+    """
+
+    def __init__(self):
+        self._client: TelegramClient | None = None
+        self._lock: asyncio.Lock | None = None
+        self.status = "disconnected"
+        self.connected_at: datetime | None = None
+        self.connects = 0
+        self.last_error: str | None = None
+
+    async def get(self) -> TelegramClient:
+        """Return the connected client, connecting or reconnecting it if needed"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._client is not None and self._client.is_connected():
+                return self._client
+
+            self.status = "connecting"
+            try:
+                if self._client is None:
+                    self._client = await create_telegram_client()
+                else:
+                    logger.warning("Shared Telegram client disconnected, reconnecting")
+                    await self._client.connect()
+            except Exception as e:
+                self.status = "error"
+                self.last_error = str(e)
+                raise
+
+            self.status = "connected"
+            self.connected_at = datetime.now()
+            self.connects += 1
+            return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.disconnect()
+        self.status = "disconnected"
+
+    def to_dict(self) -> dict:
+        connected = self._client is not None and self._client.is_connected()
+        status = self.status
+        if status == "connected" and not connected:
+            # Telethon is retrying the connection in the background
+            status = "reconnecting"
+        return {
+            "name": "TelegramClient",
+            "status": status,
+            "is_alive": connected,
+            "connected_at": self.connected_at.isoformat() if self.connected_at else None,
+            "connects": self.connects,
+            "last_error": self.last_error,
+        }
+
+
+_shared_client = SharedTelegramClient()
+
+
+def get_shared_client() -> SharedTelegramClient:
+    """Return the Telegram client shared by the API requests"""
+    return _shared_client
+
+
 async def download_file_from_telegram(channel_id: int, message_id: int, output_path: Path) -> Path:
-    """Download a file from Telegram
+    """Download a file from Telegram with the shared client
     
     Args:
         channel_id: Telegram channel ID
@@ -83,26 +156,22 @@ async def download_file_from_telegram(channel_id: int, message_id: int, output_p
         ValueError: If message not found or has no file
         RuntimeError: If download fails
     """
-    client = await create_telegram_client()
+    client = await get_shared_client().get()
     
-    try:
-        # Get the message
-        message = await client.get_messages(channel_id, ids=message_id)
-        
-        if not message:
-            raise ValueError(f"Message {message_id} not found in channel {channel_id}")
-        
-        if not message.document:
-            raise ValueError(f"Message {message_id} does not contain a file")
-        
-        # Download the file
-        downloaded_path = await client.download_media(message, file=str(output_path))
-        
-        if not downloaded_path:
-            raise RuntimeError(f"Failed to download file from message {message_id}")
-        
-        logger.info(f"Downloaded file from Telegram: {downloaded_path}")
-        return Path(downloaded_path)
-        
-    finally:
-        await client.disconnect()
+    # Get the message
+    message = await client.get_messages(channel_id, ids=message_id)
+    
+    if not message:
+        raise ValueError(f"Message {message_id} not found in channel {channel_id}")
+    
+    if not message.document:
+        raise ValueError(f"Message {message_id} does not contain a file")
+    
+    # Download the file
+    downloaded_path = await client.download_media(message, file=str(output_path))
+    
+    if not downloaded_path:
+        raise RuntimeError(f"Failed to download file from message {message_id}")
+    
+    logger.info(f"Downloaded file from Telegram: {downloaded_path}")
+    return Path(downloaded_path)
@@ -0,0 +1,180 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from pathlib import Path
+
+from PIL import Image
+from telethon import TelegramClient, types
+from telethon.errors import FloodWaitError, RPCError
+from telethon.helpers import generate_random_long
+from telethon.network import MTProtoSender
+from telethon.tl.functions.upload import SaveBigFilePartRequest
+
+logger = logging.getLogger(__name__)
+
+# Largest part Telegram accepts
+PART_SIZE = 512 * 1024
+# Files up to 10 MB must be uploaded as small files (with an MD5), which Telethon handles fine
+BIG_FILE_SIZE = 10 * 1024 * 1024
+# Parts awaiting a response on each connection
+PARTS_IN_FLIGHT_PER_CONNECTION = 2
+PART_RETRIES = 3
+
+# Telegram only shows document thumbnails up to 320x320 and 200 KB
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_MAX_BYTES = 200 * 1024
+
+try:
+    import cryptg  # noqa: F401  (picked up by Telethon for the AES work)
+    CRYPTG_AVAILABLE = True
+except ImportError:
+    CRYPTG_AVAILABLE = False
+
+
+def make_thumbnail(image_path: Path) -> bytes:
+    """Downscale a page image into a JPEG Telegram accepts as a document thumbnail"""
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+        image.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        for quality in (85, 70, 50):
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            if buffer.tell() <= THUMBNAIL_MAX_BYTES:
+                break
+    return buffer.getvalue()
+
+
+class FloodGate:
+    """
+    Pause shared by every Telegram request of a client.
+    Once any request gets a FloodWait, all requests going through the gate
+    wait until it is over instead of running into the same limit one by one.
+    """
+
+    def __init__(self):
+        self._until = 0.0
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self._until - time.monotonic())
+
+    def hold(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self._until:
+            logger.warning(f"Telegram flood wait: pausing uploads for {seconds}s")
+            self._until = until
+
+    async def wait(self):
+        while self.remaining > 0:
+            await asyncio.sleep(self.remaining)
+
+
+class ParallelUploader:
+    """
+    Upload the parts of big files over several MTProto connections at once.
+    Telethon's upload_file sends one part at a time on the client's connection;
+    here `connections` extra senders to the client's data center, sharing its
+    authorization key, each keep PARTS_IN_FLIGHT_PER_CONNECTION parts in flight.
+    """
+
+    def __init__(self, client: TelegramClient, connections: int, gate: FloodGate | None = None):
+        self.client = client
+        self.connections = connections
+        self.gate = gate or FloodGate()
+        self._senders: list[MTProtoSender] = []
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        """Open the extra connections, or reopen them after a failure"""
+        async with self._lock:
+            if self._senders:
+                return
+
+            dc = await self.client._get_dc(self.client.session.dc_id)
+            for _ in range(self.connections):
+                sender = MTProtoSender(self.client.session.auth_key, loggers=self.client._log)
+                await sender.connect(self.client._connection(
+                    dc.ip_address,
+                    dc.port,
+                    dc.id,
+                    loggers=self.client._log,
+                    proxy=self.client._proxy,
+                ))
+                self._senders.append(sender)
+            logger.info(f"Opened {self.connections} upload connections to DC {dc.id}")
+
+    async def close(self):
+        async with self._lock:
+            for sender in self._senders:
+                await sender.disconnect()
+            self._senders = []
+
+    async def _send_part(self, sender: MTProtoSender, request: SaveBigFilePartRequest):
+        for attempt in range(PART_RETRIES + 1):
+            await self.gate.wait()
+            try:
+                if not await sender.send(request):
+                    raise RuntimeError(f"Telegram rejected part {request.file_part}")
+                return
+            except FloodWaitError as e:
+                self.gate.hold(e.seconds)
+            except (RPCError, RuntimeError, ConnectionError) as e:
+                if attempt == PART_RETRIES:
+                    raise
+                logger.debug(f"Retrying part {request.file_part} after error: {e}")
+                await asyncio.sleep(2 ** attempt)
+        raise RuntimeError(f"Failed to upload part {request.file_part}")
+
+    async def _upload_parts(self, path: Path, file_id: int, part_count: int):
+        next_part = 0
+
+        async def worker(sender: MTProtoSender, fd: int):
+            nonlocal next_part
+            while next_part < part_count:
+                part = next_part
+                next_part += 1
+                data = os.pread(fd, PART_SIZE, part * PART_SIZE)
+                await self._send_part(sender, SaveBigFilePartRequest(file_id, part, part_count, data))
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            tasks = [
+                asyncio.create_task(worker(sender, fd))
+                for sender in self._senders
+                for _ in range(PARTS_IN_FLIGHT_PER_CONNECTION)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            os.close(fd)
+
+    async def upload(self, path: Path) -> types.InputFileBig:
+        """Upload a file of more than 10 MB without sending it, see TelegramClient.upload_file"""
+        size = path.stat().st_size
+        if size <= BIG_FILE_SIZE:
+            raise ValueError(f"{path.name} is too small for a parallel upload ({size} bytes)")
+
+        await self._connect()
+        file_id = generate_random_long()
+        part_count = (size + PART_SIZE - 1) // PART_SIZE
+
+        started = time.monotonic()
+        try:
+            await self._upload_parts(path, file_id, part_count)
+        except ConnectionError:
+            # Start from fresh connections next time
+            await self.close()
+            raise
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        logger.debug(
+            f"Uploaded {part_count} parts of {path.name} in {elapsed:.1f}s "
+            f"over {len(self._senders)} connections"
+        )
+        return types.InputFileBig(file_id, part_count, path.name)
@@ -16,6 +16,9 @@ fw_separator = "_"
 pdf_suffix = ".pdf"
 temp_suffix = ".temp" + pdf_suffix
 thumbnail_suffix = ".jpg"
+# Stage outputs are written under this suffix and renamed into place once the workflow is released,
+# so the folder watchers never report a file before the next stage can claim it
+staged_suffix = ".staged"
 
 def split_filename(filename: Path) -> tuple[str, str]:
     """Split filename into publication name and date string
@@ -86,3 +89,13 @@ def get_fw_filename(fw: FileWorkflow) -> str:
 
 def get_filename(publication_name: str, date_str: str) -> str:
     return publication_name + fw_separator + date_str + pdf_suffix
+
+def get_staged_path(path: Path) -> Path:
+    return path.with_name(path.name + staged_suffix)
+
+def promote_staged(path: Path) -> bool:
+    """Move a staged file left behind by a crash into place. Returns whether path exists."""
+    staged_path = get_staged_path(path)
+    if not path.exists() and staged_path.exists():
+        staged_path.replace(path)
+    return path.exists()
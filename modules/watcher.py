@@ -0,0 +1,123 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class FolderWatcher(threading.Thread):
+    """
+    Report files that are ready in a folder: closed after being written or renamed into place.
+    Uses Linux inotify when available and falls back to polling the folder, in which case a
+    file is reported once its size and mtime are unchanged between two polls.
+    """
+
+    def __init__(self, folder: Path, accept: Callable[[Path], bool], on_ready: Callable[[Path], None], poll_interval: float):
+        super().__init__(daemon=True, name=f"FolderWatcher({folder.name})")
+        self.folder = folder
+        self.accept = accept
+        self.on_ready = on_ready
+        self.poll_interval = poll_interval
+        self.mode = "starting"
+
+    def run(self):
+        try:
+            fd = self._init_inotify()
+        except OSError as e:
+            logger.info(f"inotify unavailable for {self.folder} ({e}), polling every {self.poll_interval}s")
+            self.mode = "polling"
+            self._poll()
+            return
+
+        logger.info(f"Watching {self.folder} with inotify")
+        self.mode = "inotify"
+        try:
+            self._read_events(fd)
+        except Exception as e:
+            logger.error(f"inotify watcher for {self.folder} failed ({e}), switching to polling")
+            os.close(fd)
+            self.mode = "polling"
+            self._poll()
+
+    def _report(self, path: Path):
+        if not self.accept(path):
+            return
+        try:
+            self.on_ready(path)
+        except Exception as e:
+            logger.error(f"Error handling ready file {path}: {e}")
+
+    def _init_inotify(self) -> int:
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        return fd
+
+    def _read_events(self, fd: int):
+        while True:
+            data = os.read(fd, READ_SIZE)
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, report whatever is in the folder
+                    logger.warning(f"inotify queue overflow for {self.folder}")
+                    for path in self.folder.iterdir():
+                        self._report(path)
+                elif name:
+                    self._report(self.folder / os.fsdecode(name))
+
+    def _poll(self):
+        seen: dict[Path, tuple[int, float]] = {}
+        reported: dict[Path, tuple[int, float]] = {}
+        while True:
+            current: dict[Path, tuple[int, float]] = {}
+            for path in self.folder.iterdir():
+                if not self.accept(path):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime)
+                current[path] = signature
+                # Report a file once it stopped changing between two polls
+                if seen.get(path) == signature and reported.get(path) != signature:
+                    reported[path] = signature
+                    self._report(path)
+
+            seen = current
+            reported = {path: signature for path, signature in reported.items() if path in current}
+            time.sleep(self.poll_interval)
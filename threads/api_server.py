@@ -3,10 +3,13 @@ from datetime import datetime
 from pathlib import Path
 import asyncio
 
-from modules.database import db, Publication, FileWorkflow
+from modules.database import Publication, FileWorkflow, write, STATE_QUEUED, STATE_FAILED
 from modules.utils import get_filename, guess_fw_key
-from modules.telegram import download_file_from_telegram
-from modules import config
+from modules.telegram import download_file_from_telegram, get_shared_client
+from modules.file_cache import get_file_cache
+from modules.ocr import OCR_PROFILES
+from modules.ocr_cache import get_cache as get_ocr_cache
+from modules import config, events, http_client, retry
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
@@ -19,8 +22,6 @@ from playhouse.shortcuts import model_to_dict
 
 logger = logging.getLogger(__name__)
 
-DELETION_DELAY = 300
-
 app = FastAPI(title="PR Manager API")
 _threads = []
 
@@ -28,28 +29,13 @@ _threads = []
 static_path = Path(__file__).parent.parent / "static"
 app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
 
-async def _delete_file_later(path: Path, delay: int = 300):
-    """Delete a file after a delay, ensuring it's inside the DONE_FOLDER."""
-    await asyncio.sleep(delay)
-    try:
-        # Safety: ensure we only delete files under config.DONE_FOLDER
-        try:
-            path.resolve().relative_to(config.DONE_FOLDER.resolve())
-        except Exception:
-            logger.warning(f"Refusing to delete {path}: not inside DONE_FOLDER")
-            return
-        if path.exists():
-            path.unlink()
-            logger.info(f"Deleted file {path} after {delay} seconds")
-    except Exception as e:
-        logger.error(f"Failed to delete {path}: {e}")
-
 class PublicationUpdate(BaseModel):
     enabled: bool | None = None
     display_name: str | None = None
     issue_id: str | None = None
     max_scale: int | None = None
     language: str | None = None
+    ocr_profile: str | None = None
 
 class PublicationCreate(BaseModel):
     name: str
@@ -57,6 +43,14 @@ class PublicationCreate(BaseModel):
     issue_id: str
     max_scale: int
     language: str
+    ocr_profile: str | None = None
+
+def _validate_ocr_profile(ocr_profile: str | None):
+    if ocr_profile and ocr_profile not in OCR_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown OCR profile: {ocr_profile} (available: {', '.join(OCR_PROFILES)})"
+        )
 
 class ManualDownload(BaseModel):
     publication_name: str
@@ -83,7 +77,7 @@ async def health():
 @app.post("/api/check")
 async def force_check():
     """Force an immediate check for new publications"""
-    new_issues = find_new_issues(config.THRESHOLD_DATE)
+    new_issues = await asyncio.to_thread(find_new_issues, config.THRESHOLD_DATE)
     try:
         return [model_to_dict(item) for item in new_issues]
     except Exception:
@@ -92,22 +86,21 @@ async def force_check():
 @app.get("/api/publications")
 async def get_publications():
     """Get all publications"""
-    db.connect(reuse_if_open=True)
     publications = list(Publication.select().dicts())
-    db.close()
     return publications
 
 @app.post("/api/publications")
 async def create_publication(pub: PublicationCreate):
     """Create a new publication"""
-    db.connect(reuse_if_open=True)
+    _validate_ocr_profile(pub.ocr_profile)
     try:
         publication = Publication.create(
             name=pub.name,
             display_name=pub.display_name,
             issue_id=pub.issue_id,
             max_scale=pub.max_scale,
-            language=pub.language
+            language=pub.language,
+            ocr_profile=pub.ocr_profile or None
         )
         result = {
             "id": publication.id,
@@ -116,21 +109,19 @@ async def create_publication(pub: PublicationCreate):
             "issue_id": publication.issue_id,
             "max_scale": publication.max_scale,
             "language": publication.language,
+            "ocr_profile": publication.ocr_profile,
             "enabled": publication.enabled
         }
-        db.close()
         return result
     except Exception as e:
-        db.close()
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.patch("/api/publications/{name}")
 async def update_publication(name: str, update: PublicationUpdate):
     """Update a publication"""
-    db.connect(reuse_if_open=True)
+    _validate_ocr_profile(update.ocr_profile)
     pub = Publication.get_or_none(Publication.name == name)
     if not pub:
-        db.close()
         raise HTTPException(status_code=404, detail="Publication not found")
     
     if update.enabled is not None:
@@ -141,40 +132,36 @@ async def update_publication(name: str, update: PublicationUpdate):
         pub.issue_id = update.issue_id
     if update.max_scale is not None:
         pub.max_scale = update.max_scale
+        pub.learned_scale = None
     if update.language is not None:
         pub.language = update.language
+    if update.ocr_profile is not None:
+        pub.ocr_profile = update.ocr_profile or None
     
     pub.save()
-    db.close()
     return {"status": "updated"}
 
 @app.delete("/api/publications/{name}")
 async def delete_publication(name: str):
     """Delete a publication"""
-    db.connect(reuse_if_open=True)
     pub = Publication.get_or_none(Publication.name == name)
     if not pub:
-        db.close()
         raise HTTPException(status_code=404, detail="Publication not found")
     
     pub.delete_instance()
-    db.close()
     return {"status": "deleted"}
 
 @app.delete("/api/workflow/{publication_name}/{key}")
 async def delete_workflow(publication_name: str, key: str):
     """Delete a workflow record"""
-    db.connect(reuse_if_open=True)
     workflow = FileWorkflow.get_or_none(
         FileWorkflow.publication_name == publication_name,
         FileWorkflow.key == key
     )
     if not workflow:
-        db.close()
         raise HTTPException(status_code=404, detail="Workflow not found")
 
     workflow.delete_instance()
-    db.close()
     return {"status": "deleted"}
 
 @app.get("/api/workflow")
@@ -184,8 +171,6 @@ async def get_workflow(
     search: str = Query("", description="Search by publication name or date")
 ):
     """Get workflow status for files with pagination and search"""
-    db.connect(reuse_if_open=True)
-    
     # Build query
     query = FileWorkflow.select()
     
@@ -209,9 +194,7 @@ async def get_workflow(
         .offset(offset)
         .dicts()
     )
-    
-    db.close()
-    
+
     return {
         "workflows": workflows,
         "page": page,
@@ -223,13 +206,7 @@ async def get_workflow(
 async def get_downloaded_file(publication_name: str, date_str: str):
     """Download a PDF file from Telegram"""
     # Check if file exists and is uploaded
-    db.connect(reuse_if_open=True)
-    workflow = FileWorkflow.get_or_none(
-        FileWorkflow.publication_name == publication_name,
-        FileWorkflow.key.contains(date_str),
-        FileWorkflow.uploaded == True
-    )
-    db.close()
+    workflow = FileWorkflow.get_issue(publication_name, date_str, FileWorkflow.uploaded == True)
 
     if not workflow:
         raise HTTPException(
@@ -240,7 +217,7 @@ async def get_downloaded_file(publication_name: str, date_str: str):
     # Generate filename
     filename = get_filename(publication_name, date_str)
     
-    # Save file into DONE_FOLDER
+    # Uploaded files are kept in DONE_FOLDER unless DELETE_AFTER_DONE is set
     done_file = config.DONE_FOLDER / filename
     if done_file.exists():
         logger.info(f"Serving existing file {done_file}")
@@ -256,21 +233,19 @@ async def get_downloaded_file(publication_name: str, date_str: str):
                 status_code=500,
                 detail="Workflow metadata incomplete (missing channel_id or message_id)"
             )
-        # Download file from Telegram into DONE_FOLDER
-        logger.info(f"Downloading {filename} from Telegram (channel: {workflow.channel_id}, message: {workflow.message_id})")
-        
-        downloaded_path = await download_file_from_telegram(
-            channel_id=workflow.channel_id,
-            message_id=workflow.message_id,
-            output_path=done_file
-        )
+        channel_id = int(workflow.channel_id)
+        message_id = int(workflow.message_id)
+
+        async def fetch(partial_path: Path) -> Path:
+            logger.info(f"Downloading {filename} from Telegram (channel: {channel_id}, message: {message_id})")
+            return await download_file_from_telegram(
+                channel_id=channel_id,
+                message_id=message_id,
+                output_path=partial_path
+            )
 
-        if config.DELETE_AFTER_DONE:
-            try:
-                asyncio.create_task(_delete_file_later(downloaded_path, DELETION_DELAY))
-                logger.info(f"Scheduled deletion for {downloaded_path} in {DELETION_DELAY} seconds")
-            except Exception as e:
-                logger.error(f"Failed to schedule deletion for {downloaded_path}: {e}")
+        # Served from the file cache; concurrent requests for the same issue share one download
+        downloaded_path = await get_file_cache().get(filename, fetch)
         
         # Return file as download
         return FileResponse(
@@ -291,7 +266,7 @@ async def get_downloaded_file(publication_name: str, date_str: str):
 
 @app.get("/api/threads")
 async def get_threads():
-    """Get status of background threads"""
+    """Get status of background threads and of the API's Telegram client"""
     return [
         {
             "name": t.name,
@@ -299,7 +274,25 @@ async def get_threads():
             "is_alive": t.is_alive()
         }
         for t in _threads
-    ]
+    ] + [get_shared_client().to_dict()]
+
+@app.get("/api/http")
+async def get_http_stats():
+    """Get connection pool statistics and circuit breaker states"""
+    return {
+        "pools": http_client.get_pool_stats(),
+        "breakers": retry.get_breaker_states(),
+    }
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    """Get statistics of the cache of files fetched back from Telegram"""
+    return await asyncio.to_thread(get_file_cache().to_dict)
+
+@app.get("/api/ocr_cache")
+async def get_ocr_cache_stats():
+    """Get statistics of the cache of OCR'd pages"""
+    return await asyncio.to_thread(get_ocr_cache().to_dict)
 
 @app.post("/api/download")
 async def manual_download(request: ManualDownload):
@@ -312,21 +305,25 @@ async def manual_download(request: ManualDownload):
 
         parsed_dates.append(date_str)
 
-    db.connect(reuse_if_open=True)
-
     pub = Publication.get_or_none(Publication.name == name)
     if not pub:
-        db.close()
         raise HTTPException(status_code=404, detail="Publication not found")
     
-    for date_str in parsed_dates:
-        FileWorkflow.get_or_create(
-            publication_name=name,
-            key=guess_fw_key(str(pub.issue_id), date_str),
-            defaults={'downloaded': False}
-        )
+    def create_workflows():
+        for date_str in parsed_dates:
+            fw, created = FileWorkflow.get_or_create(
+                publication_name=name,
+                key=guess_fw_key(str(pub.issue_id), date_str),
+                defaults={'downloaded': False}
+            )
+            # A manual request restarts failed workflows from the download stage
+            if not created and fw.state == STATE_FAILED:
+                FileWorkflow.update(state=STATE_QUEUED, attempts=0, downloaded=False, ocr_processed=False).where(FileWorkflow.id == fw.id).execute()
+
+    # All dates are created in one transaction on the database writer
+    await asyncio.wrap_future(write(create_workflows))
     
-    db.close()
+    events.notify(events.STAGE_DOWNLOAD)
     return {"status": "queued", "count": len(request.dates)}
 
 def start_api_server(threads=None):
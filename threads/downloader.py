@@ -1,19 +1,25 @@
+import json
 import logging
+import shutil
 import time
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from pathlib import Path
 
-from modules.database import db, Publication, FileWorkflow
-from modules.download import get_page_keys, download_issue
-from modules.utils import get_fw_date, get_fw_id, pdf_suffix, temp_suffix, get_fw_filename, thumbnail_suffix
-from modules import config
+from modules.database import Publication, FileWorkflow, write, STATE_QUEUED, STATE_DOWNLOADED, STATE_PROCESSED, STATE_FAILED, get_worker_id
+from modules.download import get_page_keys, download_issue, find_scale
+from modules.utils import get_fw_date, get_fw_id, pdf_suffix, temp_suffix, get_fw_filename, thumbnail_suffix, get_staged_path
+from modules import config, events
+from modules.ocr import get_executor, images_to_pdf, merge_pages
+from modules.ocr_cache import get_cache, save_keys
 
-import img2pdf
 
 logger = logging.getLogger(__name__)
 
 GET_PAGE_KEYS_DELAY = 1
-DOWNLOADER_DELAY = 30
+# Fallback sweep for crash recovery; new work wakes the thread through modules.events
+DOWNLOADER_DELAY = 300
 
 class DownloaderThread(threading.Thread):
     def __init__(self):
@@ -21,112 +27,328 @@ class DownloaderThread(threading.Thread):
         self.download_folder = config.DOWNLOAD_FOLDER
         self.ocr_folder = config.OCR_FOLDER
         self.status = "waiting"
+        self.worker_id = get_worker_id(self.name)
+
+        # Issues currently being downloaded (workflow id -> publication name)
+        self.claims: dict[int, str] = {}
+        # Failed workflows are left alone until the next fallback sweep
+        self.retry_after: dict[int, float] = {}
+        self.deferred = False
+        self.claims_lock = threading.Lock()
+        self.page_keys_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=config.DOWNLOAD_WORKERS, thread_name_prefix="IssueDownloader")
+
+    def get_cached_page_keys(self, fw: FileWorkflow) -> list[dict[str,str]] | None:
+        """Return the page keys cached on a workflow, if fetched within PAGE_KEYS_TTL"""
+        if not fw.page_keys or fw.page_keys_fetched_at is None:
+            return None
+
+        age = (datetime.now() - fw.page_keys_fetched_at).total_seconds()
+        if age > config.PAGE_KEYS_TTL:
+            return None
+
+        try:
+            return json.loads(str(fw.page_keys))
+        except ValueError:
+            return None
+
+    def set_cached_page_keys(self, fw: FileWorkflow, page_keys: list[dict[str,str]] | None):
+        """Cache page keys on a workflow, or clear the cache when page_keys is None"""
+        fw.page_keys = json.dumps(page_keys) if page_keys is not None else None
+        fw.page_keys_fetched_at = datetime.now() if page_keys is not None else None
+        write(FileWorkflow.update(
+            page_keys=fw.page_keys,
+            page_keys_fetched_at=fw.page_keys_fetched_at
+        ).where(FileWorkflow.id == fw.id).execute)
     
+    def fetch_page_keys(self, fw: FileWorkflow) -> list[dict[str,str]] | None:
+        """Return page keys for a workflow from the cache or the API.
+        Returns None if they could not be retrieved (the workflow is deleted on 404)."""
+        fw_filename = get_fw_filename(fw)
+
+        page_keys = self.get_cached_page_keys(fw)
+        if page_keys:
+            logger.debug(f"Using cached page keys for {fw_filename}")
+            return page_keys
+
+        # API calls stay serialized and spaced out even with several workers
+        with self.page_keys_lock:
+            time.sleep(GET_PAGE_KEYS_DELAY)
+            logger.info(f"Fetching page keys for {fw_filename}...")
+            page_keys, status_code = get_page_keys(str(fw.key))
+
+        if status_code == 404:
+            # delete the FileWorkflow as the issue does not exist
+            logger.error(f"Issue for {fw_filename} not found (404). Deleting workflow.")
+            write(fw.delete_instance).result()
+            return None
+        if status_code != 200:
+            return None
+
+        self.set_cached_page_keys(fw, page_keys)
+        return page_keys
+
+    def finish_streaming_ocr(self, fw: FileWorkflow, images: list[Path], page_futures: dict[int, Future], cache_keys: dict[int, str]) -> bool:
+        """Wait for the per-page OCR jobs of an issue and merge them into the final OCR output.
+        Newly OCR'd pages (those with a cache key) are added to the OCR cache.
+        Returns False if any page failed, so the caller can fall back to the regular OCR stage."""
+        wait(page_futures.values())
+
+        page_paths: list[Path] = []
+        for page_number in sorted(page_futures):
+            try:
+                exit_code = page_futures[page_number].result()
+            except Exception as e:
+                logger.warning(f"OCR failed for page {page_number} of {get_fw_filename(fw)}: {e}")
+                return False
+            if exit_code != 0:
+                logger.warning(f"OCR failed for page {page_number} of {get_fw_filename(fw)} with exit code {exit_code}")
+                return False
+            page_pdf = images[0].parent / f"{page_number}.ocr.pdf"
+            page_paths.append(page_pdf)
+
+            cache_key = cache_keys.get(page_number)
+            if cache_key is not None:
+                try:
+                    get_cache().put(cache_key, page_pdf)
+                except Exception as e:
+                    logger.warning(f"Failed to cache OCR output for page {page_number}: {e}")
+
+        fw_filename = get_fw_filename(fw)
+        output_path = self.ocr_folder / fw_filename
+        staged_path = get_staged_path(output_path)
+        # The thumbnail goes first, the uploader expects it once the PDF shows up
+        shutil.copyfile(images[0], self.ocr_folder / fw_filename.replace(pdf_suffix, thumbnail_suffix))
+        try:
+            merge_pages(page_paths, staged_path)
+        except Exception as e:
+            logger.error(f"Failed to merge OCR pages for {fw_filename}: {e}")
+            return False
+
+        logger.info(f"Successfully downloaded and processed {fw_filename}")
+
+        self.publish(fw, STATE_PROCESSED, staged_path, output_path, events.STAGE_UPLOAD, downloaded=True, ocr_processed=True)
+        return True
+
+    def publish(self, fw: FileWorkflow, state: str, staged_path: Path, output_path: Path, stage: str, **fields):
+        """Release a workflow to state, then move its staged output into place and wake the next stage.
+        Once released the workflow belongs to that stage: later errors are only logged,
+        and a staged file left behind is promoted by the stage's sweep."""
+        if not fw.release(state, **fields).result():
+            logger.warning(f"Lost the lease on {get_fw_filename(fw)} before releasing it; leaving it to its new owner")
+            return
+        try:
+            staged_path.replace(output_path)
+            events.notify(stage, output_path)
+        except Exception as e:
+            logger.error(f"Failed to move {output_path.name} into place: {e}")
+
+    def download_workflow(self, fw: FileWorkflow, publication: Publication) -> bool:
+        """Download a single issue and save it as a temp PDF for the OCR stage"""
+        fw_filename = get_fw_filename(fw)
+        page_keys = self.fetch_page_keys(fw)
+        if page_keys is None:
+            logger.error(f"Skipping download for {fw.publication_name} on {get_fw_date(str(fw.key))}: could not retrieve page keys")
+            return False
+
+        filename = fw_filename.replace(pdf_suffix, temp_suffix)
+        output_path = self.download_folder / filename
+
+        images: list[Path] = []
+
+        images_path = self.download_folder / str(fw.key)
+        images_path.mkdir(parents=True, exist_ok=True)
+
+        learned_scale = int(publication.learned_scale) if publication.learned_scale else None
+        scale = find_scale(
+            str(fw.key),
+            int(publication.max_scale),
+            learned_scale,
+            page_keys,
+            images_path
+        )
+        if scale is None:
+            logger.warning(f"Could not find a working scale for {filename}; skipping.")
+            # The tickets may have expired, refetch them on the next pass
+            self.set_cached_page_keys(fw, None)
+            return False
+
+        if scale != learned_scale:
+            logger.info(f"Learned scale {scale} for {fw.publication_name}")
+            write(Publication.update(learned_scale=scale).where(Publication.id == publication.id).execute)
+            publication.learned_scale = scale
+
+        # In streaming mode every page is OCR'd as soon as it lands, overlapping download and OCR
+        # Identical page images (e.g. a republished issue) are reused from the OCR cache
+        page_futures: dict[int, Future] = {}
+        cache_keys: dict[int, str] = {}
+        on_page = None
+        if config.OCR_STREAMING:
+            ocr_executor = get_executor()
+            ocr_cache = get_cache()
+            language = str(publication.language)
+            profile = publication.ocr_profile
+
+            def on_page(page_number: int, image_path: Path):
+                page_pdf = images_path / f"{page_number}.ocr.pdf"
+                if page_pdf.exists():
+                    done: Future = Future()
+                    done.set_result(0)
+                    page_futures[page_number] = done
+                    return
+
+                cache_key = ocr_cache.get_key(image_path, language, profile)
+                if ocr_cache.get(cache_key, page_pdf):
+                    logger.debug(f"Reusing cached OCR output for page {page_number}")
+                    done = Future()
+                    done.set_result(0)
+                    page_futures[page_number] = done
+                    return
+
+                cache_keys[page_number] = cache_key
+                page_futures[page_number] = ocr_executor.submit_page(image_path, page_pdf, language, profile)
+
+        logger.info(f"Attempting download for {fw_filename} with issue number {get_fw_id(str(fw.key))}...")
+        images = download_issue(
+            str(fw.publication_name),
+            str(fw.key),
+            scale,
+            page_keys,
+            images_path,
+            on_page
+        )
+
+        # save all images as pdf
+        if len(images) <= 1:
+            logger.warning(f"Not enough images downloaded for {filename} ({len(images)}); skipping PDF creation.")
+            self.set_cached_page_keys(fw, None)
+            return False
+
+        if page_futures:
+            if self.finish_streaming_ocr(fw, images, page_futures, cache_keys):
+                shutil.rmtree(images_path, ignore_errors=True)
+                return True
+            logger.warning(f"Streaming OCR failed for {filename}; falling back to the OCR stage.")
+
+        # Outside streaming mode an issue whose pages are all in the OCR cache (e.g. a republished
+        # issue) skips the OCR stage; otherwise the OCR stage caches its pages under these keys
+        ocr_cache = get_cache()
+        language = str(publication.language)
+        page_keys_by_number = {
+            int(image.stem): ocr_cache.get_key(image, language, publication.ocr_profile)
+            for image in images
+        }
+        if not page_futures:
+            cached: dict[int, Future] = {}
+            for page_number, cache_key in page_keys_by_number.items():
+                if not ocr_cache.get(cache_key, images_path / f"{page_number}.ocr.pdf"):
+                    break
+                cached[page_number] = Future()
+                cached[page_number].set_result(0)
+            else:
+                logger.info(f"Reusing cached OCR output for every page of {filename}")
+                if self.finish_streaming_ocr(fw, images, cached, {}):
+                    shutil.rmtree(images_path, ignore_errors=True)
+                    return True
+
+        logger.info(f"Saving {filename} as PDF...")
+        # Written under a staged name and renamed once released, so the OCR thread can claim it when it shows up
+        staged_path = get_staged_path(output_path)
+        try:
+            save_keys(output_path, [page_keys_by_number[page_number] for page_number in sorted(page_keys_by_number)])
+            images_to_pdf(images, staged_path)
+        except Exception as e:
+            logger.error(f"Failed to convert images to PDF for {filename}: {e}")
+            return False
+
+        # Also save thumbnail as jpg
+        ocr_output_path = self.ocr_folder / (filename.replace(temp_suffix, thumbnail_suffix))
+        shutil.copyfile(images[0], ocr_output_path)
+
+        # delete images and manifest from disk
+        shutil.rmtree(images_path, ignore_errors=True)
+
+        logger.info(f"Successfully downloaded {filename}")
+
+        self.publish(fw, STATE_DOWNLOADED, staged_path, output_path, events.STAGE_OCR, downloaded=True)
+        return True
+
+    def _run_workflow(self, fw: FileWorkflow, publication: Publication):
+        """Worker entry point: download an issue and release its claim"""
+        succeeded = False
+        try:
+            succeeded = self.download_workflow(fw, publication)
+        except Exception as e:
+            logger.error(f"Error downloading {get_fw_filename(fw)}: {e}")
+        finally:
+            if not succeeded:
+                try:
+                    fw.release_failed(STATE_QUEUED)
+                    if fw.state == STATE_FAILED:
+                        logger.error(f"Giving up on {get_fw_filename(fw)} after {fw.attempts} attempts")
+                except Exception as e:
+                    logger.error(f"Failed to release {get_fw_filename(fw)}: {e}")
+            with self.claims_lock:
+                del self.claims[fw.id]
+                if not succeeded:
+                    self.retry_after[fw.id] = time.monotonic() + DOWNLOADER_DELAY
+                wake = self.deferred
+                self.status = "running" if self.claims else "waiting"
+            # Issues held back by the concurrency caps can start now
+            if wake:
+                events.notify(events.STAGE_DOWNLOAD)
+
+    def claim_workflows(self):
+        """Lease pending workflows and submit them to the worker pool, respecting the global and per-publication caps"""
+        fws = FileWorkflow.pending(STATE_QUEUED)
+
+        pubs_map: dict[str, Publication] = {}
+        pubs_names = set(fw.publication_name for fw in fws)
+        pubs_list: list[Publication] = list(Publication.select().where(Publication.name.in_(pubs_names)))
+        for pub in pubs_list:
+            pubs_map[str(pub.name)] = pub
+
+        now = time.monotonic()
+        with self.claims_lock:
+            self.deferred = False
+            per_publication: dict[str, int] = {}
+            for name in self.claims.values():
+                per_publication[name] = per_publication.get(name, 0) + 1
+
+            selected: dict[int, Publication] = {}
+            for fw in fws:
+                name = str(fw.publication_name)
+                if fw.id in self.claims or self.retry_after.get(fw.id, 0) > now:
+                    continue
+
+                publication = pubs_map.get(name)
+                if publication is None:
+                    logger.error(f"Publication {fw.publication_name} not found in database; skipping.")
+                    continue
+
+                if len(self.claims) + len(selected) >= config.DOWNLOAD_WORKERS or per_publication.get(name, 0) >= config.DOWNLOAD_WORKERS_PER_PUBLICATION:
+                    self.deferred = True
+                    continue
+
+                selected[fw.id] = publication
+                per_publication[name] = per_publication.get(name, 0) + 1
+
+            # Other workers may have leased some of them since they were read
+            for fw in FileWorkflow.claim(list(selected), STATE_QUEUED, self.worker_id):
+                self.claims[fw.id] = str(fw.publication_name)
+                self.retry_after.pop(fw.id, None)
+                self.executor.submit(self._run_workflow, fw, selected[fw.id])
+
+            if self.claims:
+                self.status = "running"
+
     def run(self):
         logger.info("Downloader thread running")
 
         while True:
             try:
-                self.status = "running"
-                db.connect(reuse_if_open=True)
-                # Get FileWorkflows that are not yet downloaded
-                fws: list[FileWorkflow] = list(FileWorkflow.select().where((FileWorkflow.downloaded == False)))
-                db.close()
-
-                pubs_map: dict[str, Publication] = {}
-                pubs_names = set(fw.publication_name for fw in fws)
-                pubs_list: list[Publication] = list(Publication.select().where(Publication.name.in_(pubs_names)))
-                for pub in pubs_list:
-                    pubs_map[str(pub.name)] = pub
-
-                # Get keys for each FileWorkflow first
-                keys_map: dict[str, list[dict[str,str]]] = {}
-                for fw in fws:
-                    fw_filename = get_fw_filename(fw)
-                    publication = pubs_map.get(str(fw.publication_name))
-                    if publication is None:
-                        logger.error(f"Publication {fw.publication_name} not found in database; skipping.")
-                        continue
-
-                    time.sleep(GET_PAGE_KEYS_DELAY)
-                    logger.info(f"Fetching page keys for {fw_filename}...")
-                    page_keys, status_code = get_page_keys(str(fw.key))
-                    if status_code == 404:
-                        # delete the FileWorkflow as the issue does not exist
-                        logger.error(f"Issue for {fw_filename} not found (404). Deleting workflow.")
-                        db.connect(reuse_if_open=True)
-                        fw.delete_instance()
-                        db.close()
-                        continue
-                    if len(page_keys) >= 0:
-                        keys_map[fw_filename] = page_keys
-                
-                # Download each issue
-                for fw in fws:
-                    fw_filename = get_fw_filename(fw)
-                    if fw_filename not in keys_map:
-                        logger.error(f"Skipping download for {fw.publication_name} on {get_fw_date(str(fw.key))}: could not retrieve page keys")
-                        continue
-                    
-                    filename = fw_filename.replace(pdf_suffix, temp_suffix)
-                    output_path = self.download_folder / filename
-
-                    publication = pubs_map.get(str(fw.publication_name))
-                    if publication is None:
-                        logger.error(f"Publication {fw.publication_name} not found in database; skipping.")
-                        continue
-
-                    page_keys = keys_map[fw_filename]
-
-                    images: list[bytes] = []
-
-                    images_path = self.download_folder / str(fw.key)
-                    images_path.mkdir(parents=True, exist_ok=True)
-
-                    logger.info(f"Attempting download for {fw_filename} with issue number {get_fw_id(str(fw.key))}...")
-                    images = download_issue(
-                        str(fw.publication_name),
-                        str(fw.key),
-                        int(publication.max_scale),
-                        page_keys,
-                        images_path
-                    )
-
-                    # save all images as pdf
-                    if len(images) <= 1:
-                        logger.warning(f"Not enough images downloaded for {filename} ({len(images)}); skipping PDF creation.")
-                        continue
-
-                    logger.info(f"Saving as PDF...")
-                    pdf_bytes = img2pdf.convert(images)
-                    if pdf_bytes is None:
-                        logger.error(f"Failed to convert images to PDF for {filename}")
-                        continue
-                    
-                    with open(output_path, 'wb') as f:
-                        _ = f.write(pdf_bytes)
-
-                    # Also save thumbnail as jpg
-                    ocr_output_path = self.ocr_folder / (filename.replace(temp_suffix, thumbnail_suffix))
-                    with open(ocr_output_path, 'wb') as f:
-                        _ = f.write(images[0])
-
-                    # delete images from disk
-                    for img_file in images_path.glob("*.jpg"):
-                        img_file.unlink(missing_ok=True)
-                    images_path.rmdir()
-
-                    logger.info(f"Successfully downloaded {filename}")
-
-                    db.connect(reuse_if_open=True)
-                    fw.downloaded = True
-                    fw.updated_at = datetime.now()
-                    fw.save()
-                    db.close()
-                
+                self.claim_workflows()
             except Exception as e:
                 logger.error(f"Error in downloader thread: {e}")
-            finally:
-                self.status = "waiting"
 
-            time.sleep(DOWNLOADER_DELAY)
+            events.wait(events.STAGE_DOWNLOAD, DOWNLOADER_DELAY)
@@ -1,12 +1,14 @@
 import logging
+from concurrent.futures import Future
 from pathlib import Path
-import time
+from queue import Empty, SimpleQueue
 import threading
-from datetime import datetime
-import ocrmypdf
-from modules.database import db, Publication, FileWorkflow
-from modules.utils import split_filename, temp_suffix, get_filename
-from modules import config
+from modules.database import Publication, FileWorkflow, STATE_DOWNLOADED, STATE_PROCESSED, STATE_FAILED, get_worker_id
+from modules.utils import split_filename, pdf_suffix, temp_suffix, get_filename, get_fw_filename, get_staged_path, promote_staged
+from modules import config, events
+from modules.ocr import get_executor
+from modules.ocr_cache import get_cache, get_keys_path, load_keys
+from modules.watcher import FolderWatcher
 
 import warnings
 
@@ -14,7 +16,8 @@ warnings.filterwarnings("ignore")
 
 logger = logging.getLogger(__name__)
 
-OCR_PROCESSOR_DELAY = 30
+# Fallback sweep for crash recovery; new work wakes the thread through modules.events
+OCR_PROCESSOR_DELAY = 300
 
 class OCRProcessorThread(threading.Thread):
     def __init__(self):
@@ -22,84 +25,168 @@ class OCRProcessorThread(threading.Thread):
         self.download_folder = config.DOWNLOAD_FOLDER
         self.ocr_folder = config.OCR_FOLDER
         self.status = "waiting"
+        self.worker_id = get_worker_id(self.name)
+
+        self.executor = get_executor()
+        # Temp files queued or running in the OCR executor
+        self.in_progress: set[Path] = set()
+        self.in_progress_lock = threading.Lock()
+        # OCR jobs done in the executor, recorded by run() rather than on the pool's own thread
+        self.finished: SimpleQueue[tuple[Future, Path, Path, str, FileWorkflow | None]] = SimpleQueue()
         
     def process_file(self, temp_file: Path):
-        """Process a single temp PDF file with OCR"""
+        """Queue a single temp PDF file for OCR"""
+        leased: FileWorkflow | None = None
         try:
             publication_name, date_str = split_filename(temp_file)
             output_filename = get_filename(publication_name, date_str)
             output_path = self.ocr_folder / output_filename
             ocr_language: str = "ita"
+            ocr_profile: str | None = None
             
             # Check if already processed
-            db.connect(reuse_if_open=True)
-            workflow = FileWorkflow.get_or_none(
-                FileWorkflow.publication_name == publication_name,
-                FileWorkflow.key.contains(date_str)
-            )
+            workflow = FileWorkflow.get_ready_issue(publication_name, date_str, STATE_DOWNLOADED)
 
             if workflow:
                 if workflow.ocr_processed and output_path.exists():
                     logger.debug(f"File {output_filename} already processed")
                     temp_file.unlink(missing_ok=True)
+                    get_keys_path(temp_file).unlink(missing_ok=True)
                     return
 
-                if not workflow.downloaded:
-                    logger.warning(f"File {temp_file.name} not marked as downloaded; skipping OCR processing.")
+                # The lease keeps other workers, in this process or another, off the file
+                claimed = FileWorkflow.claim([workflow.id], STATE_DOWNLOADED, self.worker_id)
+                if not claimed:
+                    logger.debug(f"File {temp_file.name} not ready for OCR or already claimed; skipping.")
                     return
+                workflow = leased = claimed[0]
 
                 publication = Publication.get_or_none(Publication.name == publication_name)
                 if publication:
                     ocr_language = str(publication.language)
-            
-            db.close()
+                    ocr_profile = publication.ocr_profile
+
+            with self.in_progress_lock:
+                if temp_file in self.in_progress:
+                    return
+                self.in_progress.add(temp_file)
+                self.status = "running"
             
             logger.info(f"Processing {temp_file.name} with OCR")
-            
-            # Run OCR
-            exit_code = ocrmypdf.ocr(
-                temp_file,
-                output_path,
-                skip_text=True,
-                optimize=0,
-                quiet=True,
-                progress_bar=False,
-                language=ocr_language
+            # Renamed into place once released, so the uploader can claim it when it shows up
+            future = self.executor.submit(temp_file, get_staged_path(output_path), ocr_language, ocr_profile)
+            future.add_done_callback(
+                lambda f: self.job_done(f, temp_file, output_path, ocr_language, workflow)
             )
+            
+        except Exception as e:
+            logger.error(f"Error processing {temp_file.name}: {e}")
+            if leased:
+                self.release_failed(leased)
+
+    def job_done(self, future: Future, temp_file: Path, output_path: Path, ocr_language: str, workflow: FileWorkflow | None):
+        """Done-callback of an OCR job. It runs on the executor's manager thread, which must not block,
+        so the job is only handed over to run()"""
+        self.finished.put((future, temp_file, output_path, ocr_language, workflow))
+        events.notify(events.STAGE_OCR)
+
+    def finish_jobs(self) -> int:
+        """Record the outcome of every OCR job handed over by job_done(). Returns how many there were."""
+        count = 0
+        while True:
+            try:
+                job = self.finished.get_nowait()
+            except Empty:
+                return count
+            self.finish_file(*job)
+            count += 1
+
+    def finish_file(self, future: Future, temp_file: Path, output_path: Path, ocr_language: str, workflow: FileWorkflow | None):
+        """Record the outcome of an OCR job once its worker process is done"""
+        succeeded = False
+        staged_path = get_staged_path(output_path)
+        try:
+            exit_code = future.result()
             if exit_code != 0:
                 logger.error(f"OCR ({ocr_language}) processing failed for {temp_file.name} with exit code {exit_code}")
                 return
             
+            # Cache the OCR'd pages, so a republished issue does not go through OCR again
+            keys = load_keys(temp_file)
+            if keys:
+                try:
+                    get_cache().put_pages(keys, staged_path)
+                except Exception as e:
+                    logger.warning(f"Failed to cache OCR output of {output_path.name}: {e}")
+
             # Update database
-            if workflow:
-                db.connect(reuse_if_open=True)
-                workflow.ocr_processed = True
-                workflow.updated_at = datetime.now()
-                workflow.save()
-                db.close()
-                
+            released = workflow.release(STATE_PROCESSED, ocr_processed=True).result() if workflow else True
+            succeeded = True
+            if not released:
+                logger.warning(f"Lost the lease on {output_path.name} before releasing it; leaving it to its new owner")
+                return
+            staged_path.replace(output_path)
+
             # Remove temp file
             temp_file.unlink(missing_ok=True)
-            logger.info(f"Successfully processed {output_filename}")
+            get_keys_path(temp_file).unlink(missing_ok=True)
+            logger.info(f"Successfully processed {output_path.name}")
+            events.notify(events.STAGE_UPLOAD, output_path)
             
         except Exception as e:
             logger.error(f"Error processing {temp_file.name}: {e}")
+        finally:
+            if not succeeded:
+                staged_path.unlink(missing_ok=True)
+            if workflow and not succeeded:
+                self.release_failed(workflow)
+            with self.in_progress_lock:
+                self.in_progress.discard(temp_file)
+                if not self.in_progress:
+                    self.status = "waiting"
     
+    def release_failed(self, workflow: FileWorkflow):
+        """Hand a workflow back to the OCR queue after a failed attempt"""
+        try:
+            workflow.release_failed(STATE_DOWNLOADED)
+            if workflow.state == STATE_FAILED:
+                logger.error(f"Giving up on OCR for {get_fw_filename(workflow)} after {workflow.attempts} attempts")
+        except Exception as e:
+            logger.error(f"Failed to release {get_fw_filename(workflow)}: {e}")
+
     def run(self):
         logger.info("OCR processor thread running")
-        
+
+        self.watcher = FolderWatcher(
+            self.download_folder,
+            accept=lambda path: path.name.endswith(temp_suffix),
+            on_ready=lambda path: events.notify(events.STAGE_OCR, path),
+            poll_interval=config.WATCHER_POLL_INTERVAL,
+        )
+        self.watcher.start()
+
+        ready: set[Path] = set()
         while True:
+            finished = self.finish_jobs()
             try:
-                self.status = "running"
-                # Find all .temp.pdf files
-                temp_files = list(self.download_folder.glob("*" + temp_suffix))
+                # Files reported ready by the watcher or the downloader; OCR queue on the fallback sweep,
+                # unless the thread was only woken up to record finished jobs
+                if ready:
+                    temp_files = sorted(f for f in ready if f.exists())
+                elif finished:
+                    temp_files = []
+                else:
+                    temp_files = [
+                        self.download_folder / get_fw_filename(fw).replace(pdf_suffix, temp_suffix)
+                        for fw in FileWorkflow.pending(STATE_DOWNLOADED)
+                    ]
+                    temp_files = [f for f in temp_files if promote_staged(f)]
                 
                 for temp_file in temp_files:
                     self.process_file(temp_file)
                 
             except Exception as e:
                 logger.error(f"Error in OCR processor thread: {e}")
-            finally:
-                self.status = "waiting"
 
-            time.sleep(OCR_PROCESSOR_DELAY)
+            events.wait(events.STAGE_OCR, OCR_PROCESSOR_DELAY)
+            ready = events.take(events.STAGE_OCR)
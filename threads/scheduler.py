@@ -1,12 +1,13 @@
 import logging
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from modules.database import db, Publication, FileWorkflow
+from modules.database import Publication, FileWorkflow, write
 from modules.download import get_issue_info
 from modules.utils import date_format, get_fw_date
-from modules import config
+from modules import config, events
 
 import schedule
 
@@ -14,57 +15,83 @@ logger = logging.getLogger(__name__)
 
 SCHEDULER_DELAY = 1
 
+def _get_latest_issue_key(pub: Publication) -> str | None:
+    """Return the key of the latest issue of a publication, or None"""
+    info = get_issue_info(str(pub.issue_id))
+    if info is None:
+        logger.error(f"Failed to get issue info for publication {pub.name}")
+        return None
+
+    latest_issue = info.get("latestIssue", {})
+    key: str = latest_issue.get("key", "")
+    if not key:
+        logger.debug(f"No latest issue found for publication {pub.name}")
+        return None
+    return key
+
 def find_new_issues(threshold_date: str) -> list[FileWorkflow]:
-    """Find new issues for all enabled publications and create FileWorkflow entries for them."""
+    """Find new issues for all enabled publications and create FileWorkflow entries for them.
+    Catalog lookups run concurrently (CATALOG_WORKERS at a time), then all entries are
+    created in a single write on the database writer."""
     created_workflows = []
     try:
+        started = time.monotonic()
         today = datetime.now().strftime(date_format)
 
-        db.connect(reuse_if_open=True)
         publications: list[Publication] = list(
             Publication.select().where(
                 (Publication.enabled == True) &
                 ((Publication.last_finished != today) | (Publication.last_finished.is_null()))
             )
         )
-        db.close()
-        
-        for pub in publications:
-            info = get_issue_info(str(pub.issue_id))
-            if info is None:
-                logger.error(f"Failed to get issue info for publication {pub.name}")
-                continue
 
-            latest_issue = info.get("latestIssue", {})
-            key: str = latest_issue.get("key", "")
-            if not key:
-                logger.debug(f"No latest issue found for publication {pub.name}")
+        with ThreadPoolExecutor(max_workers=config.CATALOG_WORKERS, thread_name_prefix="CatalogPoller") as executor:
+            latest_keys = list(executor.map(_get_latest_issue_key, publications))
+        catalog_time = time.monotonic() - started
+
+        new_issues: list[tuple[Publication, str, str]] = []
+        for pub, key in zip(publications, latest_keys):
+            if key is None:
                 continue
-            
+
             issue_date = get_fw_date(key)
             if issue_date < threshold_date:
                 logger.debug(f"Publication {pub.name}'s latest issue date {issue_date} is before threshold {threshold_date}")
                 continue
 
             logger.info(f"Found new issue for publication {pub.name} on {issue_date}")
-            db.connect(reuse_if_open=True)
-            # create an empty FileWorkflow if not exists
-            fw, created = FileWorkflow.get_or_create(
-                publication_name=pub.name,
-                key=key,
-                defaults={"downloaded": False}
-            )
-            db.close()
+            new_issues.append((pub, key, issue_date))
 
-            if fw.downloaded:
-                logger.debug(f"Issue for publication {pub.name} on {issue_date} already scheduled/downloaded")
-                continue
+        def create_workflows():
+            for pub, key, issue_date in new_issues:
+                # create an empty FileWorkflow if not exists
+                fw, created = FileWorkflow.get_or_create(
+                    publication_name=pub.name,
+                    key=key,
+                    defaults={"downloaded": False}
+                )
+
+                if fw.downloaded:
+                    logger.debug(f"Issue for publication {pub.name} on {issue_date} already scheduled/downloaded")
+                    continue
+
+                if created:
+                    created_workflows.append(fw)
+
+                logger.info(f"Scheduling download for publication {pub.name} on {issue_date}")
+
+        if new_issues:
+            write(create_workflows).result()
+
+        if created_workflows:
+            events.notify(events.STAGE_DOWNLOAD)
+
+        total_time = time.monotonic() - started
+        logger.info(
+            f"Checked {len(publications)} publications in {total_time:.1f}s "
+            f"(catalog {catalog_time:.1f}s), {len(created_workflows)} new workflows"
+        )
 
-            if created:
-                created_workflows.append(fw)
-            
-            logger.info(f"Scheduling download for publication {pub.name} on {issue_date}")
-  
     except Exception as e:
         logger.error(f"Error in scheduler thread: {e}")
         
@@ -1,20 +1,37 @@
 import logging
-import time
 import threading
-from pathlib import Path
+import time
 from datetime import datetime
+from pathlib import Path
 import asyncio
 
-from modules import config
-from modules.database import Publication, db, FileWorkflow
-from modules.utils import get_caption, split_filename, thumbnail_suffix
+from modules import config, events
+from modules.database import Publication, FileWorkflow, write, STATE_PROCESSED, STATE_DONE, STATE_FAILED, get_worker_id
+from modules.utils import get_caption, split_filename, thumbnail_suffix, pdf_suffix, temp_suffix, get_fw_filename, date_format, promote_staged
+from modules.watcher import FolderWatcher
 from modules.telegram import get_telegram_credentials, create_telegram_client
+from modules.telegram_upload import FloodGate, ParallelUploader, make_thumbnail, BIG_FILE_SIZE, CRYPTG_AVAILABLE
 
-from telethon import TelegramClient
+from telethon import TelegramClient, types
+from telethon.errors import FloodWaitError
 
 logger = logging.getLogger(__name__)
 
-UPLOADER_DELAY = 30
+# Fallback sweep for crash recovery; new work wakes the thread through modules.events
+UPLOADER_DELAY = 300
+
+# FloodWaits a single Telegram request may wait out before the upload counts as failed
+FLOOD_WAIT_RETRIES = 5
+
+# Upload queue priorities: today's issues go before back issues
+PRIORITY_TODAY = 0
+PRIORITY_BACKLOG = 1
+
+# thumb: a single message, with the first page downscaled as the PDF's thumbnail
+# separate: the first page as a photo message of its own, then the PDF
+UPLOAD_MODE_THUMB = "thumb"
+UPLOAD_MODE_SEPARATE = "separate"
+UPLOAD_MODES = (UPLOAD_MODE_THUMB, UPLOAD_MODE_SEPARATE)
 
 class TelegramUploaderThread(threading.Thread):
     def __init__(self):
@@ -23,10 +40,24 @@ class TelegramUploaderThread(threading.Thread):
         self.done_folder = config.DONE_FOLDER
         self.delete_after_done = config.DELETE_AFTER_DONE
         self.status = "waiting"
+        self.worker_id = get_worker_id(self.name)
         
         self.api_id, self.api_hash, self.channel = get_telegram_credentials()
         self.client: TelegramClient | None = None
+        self.parallel_uploader: ParallelUploader | None = None
         self.loop = asyncio.new_event_loop()
+
+        # Every Telegram request waits out a FloodWait received by any of them
+        self.flood_gate = FloodGate()
+        # Files waiting for an upload worker, ordered by (priority, age)
+        self.queue: asyncio.PriorityQueue[tuple[int, float, str]] | None = None
+        self.queued: set[Path] = set()
+        self.in_flight = 0
+
+        self.upload_mode = config.TELEGRAM_UPLOAD_MODE
+        if self.upload_mode not in UPLOAD_MODES:
+            logger.warning(f"Unknown TELEGRAM_UPLOAD_MODE {self.upload_mode}, using {UPLOAD_MODE_THUMB}")
+            self.upload_mode = UPLOAD_MODE_THUMB
         
     def setup_client(self):
         """Setup Telegram client without interactive prompts.
@@ -45,93 +76,235 @@ class TelegramUploaderThread(threading.Thread):
             self.client = self.loop.run_until_complete(async_setup())
             if self.client is None:
                 return False
+            # Flood waits are handled by the shared gate rather than by sleeping inside each request
+            self.client.flood_sleep_threshold = 0
+            if config.TELEGRAM_UPLOAD_CONNECTIONS > 0:
+                self.parallel_uploader = ParallelUploader(self.client, config.TELEGRAM_UPLOAD_CONNECTIONS, self.flood_gate)
+            if not CRYPTG_AVAILABLE:
+                logger.warning("cryptg is not installed, uploads will be slowed down by pure Python encryption")
             return True
         except Exception as e:
             logger.error(f"Failed to setup Telegram client: {e}")
             return False
 
-    async def async_upload(self, pdf_file: Path, display_name: str):
+    async def call_telegram(self, workflow: FileWorkflow | None, request, *args, **kwargs):
+        """Await a Telegram request, waiting out FloodWaits through the shared gate.
+        Only this request is repeated, and the workflow's lease is extended to cover each wait."""
+        for attempt in range(FLOOD_WAIT_RETRIES + 1):
+            await self.flood_gate.wait()
+            try:
+                return await request(*args, **kwargs)
+            except FloodWaitError as e:
+                if attempt == FLOOD_WAIT_RETRIES:
+                    raise
+                self.flood_gate.hold(e.seconds)
+                if workflow:
+                    seconds = self.flood_gate.remaining + config.WORKFLOW_LEASE_SECONDS
+                    if not await asyncio.to_thread(lambda: workflow.extend_lease(seconds).result()):
+                        raise RuntimeError(f"Lost the lease on {get_fw_filename(workflow)} during a flood wait")
+
+    async def async_upload(self, pdf_file: Path, display_name: str, workflow: FileWorkflow | None = None):
         if self.client is None:
             raise RuntimeError("Telegram client is not initialized")
 
         caption = get_caption(pdf_file, display_name)
         thumbnail_path = pdf_file.with_suffix(thumbnail_suffix)
+        thumb: bytes | None = None
         
-        if thumbnail_path.exists():
-            _ = await self.client.send_file(
+        if not thumbnail_path.exists():
+            logger.warning(f"No thumbnail found for {pdf_file.name}")
+        elif self.upload_mode == UPLOAD_MODE_THUMB:
+            try:
+                thumb = await asyncio.to_thread(make_thumbnail, thumbnail_path)
+            except Exception as e:
+                logger.warning(f"Failed to create a thumbnail for {pdf_file.name}: {e}")
+        else:
+            _ = await self.call_telegram(
+                workflow,
+                self.client.send_file,
                 self.channel,
                 str(thumbnail_path),
                 silent=True,
             )
-        else:
-            logger.warning(f"No thumbnail found for {pdf_file.name}")
 
-        return await self.client.send_file(
+        size = pdf_file.stat().st_size
+        started = time.monotonic()
+        # The file is uploaded once, so a FloodWait on the message only repeats sending it
+        file: types.InputFile | types.InputFileBig | None = None
+        # Big files are uploaded part by part over several connections
+        if self.parallel_uploader and size > BIG_FILE_SIZE:
+            try:
+                file = await self.parallel_uploader.upload(pdf_file)
+            except Exception as e:
+                logger.warning(f"Parallel upload of {pdf_file.name} failed ({e}), retrying over a single connection")
+        if file is None:
+            file = await self.call_telegram(workflow, self.client.upload_file, str(pdf_file))
+
+        message = await self.call_telegram(
+            workflow,
+            self.client.send_file,
             self.channel,
-            str(pdf_file),
-            caption=caption
+            file,
+            caption=caption,
+            thumb=thumb
         )
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        size_mb = size / 1024 / 1024
+        logger.info(f"Sent {pdf_file.name} ({size_mb:.1f} MB) in {elapsed:.1f}s, {size_mb / elapsed:.1f} MB/s")
+        return message
     
-    def upload_file(self, pdf_file: Path):
+    @staticmethod
+    def is_upload_candidate(path: Path) -> bool:
+        """Whether a file in the OCR folder is a finished PDF (not a .temp.pdf)"""
+        return path.name.endswith(pdf_suffix) and not path.name.endswith(temp_suffix)
+
+    def release_failed(self, workflow: FileWorkflow):
+        """Hand a workflow back to the upload queue after a failed attempt"""
+        try:
+            workflow.release_failed(STATE_PROCESSED)
+            if workflow.state == STATE_FAILED:
+                logger.error(f"Giving up on uploading {get_fw_filename(workflow)} after {workflow.attempts} attempts")
+        except Exception as e:
+            logger.error(f"Failed to release {get_fw_filename(workflow)}: {e}")
+
+    def prepare_upload(self, pdf_file: Path) -> tuple[FileWorkflow | None, Publication | None] | None:
+        """Look up and lease the workflow of a file. Returns None if the file must not be uploaded."""
+        publication_name, date_str = split_filename(pdf_file)
+        
+        # Check if already uploaded
+        workflow = FileWorkflow.get_ready_issue(publication_name, date_str, STATE_PROCESSED)
+        publication = Publication.get_or_none(Publication.name == publication_name)
+        
+        if workflow and workflow.uploaded:
+            logger.debug(f"File {pdf_file.name} already uploaded")
+            pdf_file.unlink(missing_ok=True)
+            return None
+        
+        if workflow:
+            # The lease keeps other workers, in this process or another, off the file
+            claimed = FileWorkflow.claim([workflow.id], STATE_PROCESSED, self.worker_id)
+            if not claimed:
+                logger.debug(f"File {pdf_file.name} not ready for upload or already claimed; skipping.")
+                return None
+            workflow = claimed[0]
+
+        return workflow, publication
+
+    def finish_upload(self, pdf_file: Path, workflow: FileWorkflow | None, publication: Publication | None, message_id: int):
+        """Record a sent file and move it out of the OCR folder"""
+        # Delete thumbnail
+        thumbnail_path = pdf_file.with_suffix(thumbnail_suffix)
+        thumbnail_path.unlink(missing_ok=True)
+
+        # Update database
+        if workflow:
+            release = workflow.release(STATE_DONE, uploaded=True, channel_id=self.channel, message_id=message_id)
+
+            if publication:
+                _, date_str = split_filename(pdf_file)
+                publication.last_finished = date_str
+                write(Publication.update(last_finished=date_str).where(Publication.id == publication.id).execute)
+            # The file goes away next, make sure the upload is recorded first
+            release.result()
+        
+        logger.info(f"Successfully uploaded {pdf_file.name}")
+        
+        if self.delete_after_done:
+            pdf_file.unlink(missing_ok=True)
+        else:
+            done_path = self.done_folder / pdf_file.name
+            pdf_file.rename(done_path)
+
+    async def upload_file(self, pdf_file: Path):
         """Upload a single PDF file to Telegram"""
+        leased: FileWorkflow | None = None
         try:
-            publication_name, date_str = split_filename(pdf_file)
-            
-            # Check if already uploaded
-            db.connect(reuse_if_open=True)
-            workflow = FileWorkflow.get_or_none(
-                FileWorkflow.publication_name == publication_name,
-                FileWorkflow.key.contains(date_str)
-            )
-            publication = Publication.get_or_none(Publication.name == publication_name)
-            db.close()
-            
-            if workflow and workflow.uploaded:
-                logger.debug(f"File {pdf_file.name} already uploaded")
-                pdf_file.unlink(missing_ok=True)
-                return
-            
-            if workflow and not workflow.ocr_processed:
-                logger.warning(f"File {pdf_file.name} not OCR processed yet; skipping upload.")
+            # Database calls wait on the writer thread, keep them off the event loop
+            job = await asyncio.to_thread(self.prepare_upload, pdf_file)
+            if job is None:
                 return
+            workflow, publication = job
+            leased = workflow
 
             display_name = publication.display_name if publication and publication.display_name else ""
             
             logger.info(f"Uploading {pdf_file.name} to Telegram")
-            result = self.loop.run_until_complete(self.async_upload(pdf_file, str(display_name)))
+            result = await self.async_upload(pdf_file, str(display_name), workflow)
             
             if not result.id:
                 logger.error(f"Failed to upload {pdf_file.name}: no message ID returned")
+                if leased:
+                    await asyncio.to_thread(self.release_failed, leased)
                 return
 
-            # Delete thumbnail
-            thumbnail_path = pdf_file.with_suffix(thumbnail_suffix)
-            thumbnail_path.unlink(missing_ok=True)
-
-            # Update database
-            if workflow:
-                db.connect(reuse_if_open=True)
-                workflow.uploaded = True
-                workflow.channel_id = self.channel
-                workflow.message_id = result.id
-                workflow.updated_at = datetime.now()
-                workflow.save()
-
-                if publication:
-                    publication.last_finished = date_str
-                    publication.save()
-                db.close()
-            
-            logger.info(f"Successfully uploaded {pdf_file.name}")
-            
-            if self.delete_after_done:
-                pdf_file.unlink(missing_ok=True)
-            else:
-                done_path = self.done_folder / pdf_file.name
-                pdf_file.rename(done_path)
+            leased = None
+            await asyncio.to_thread(self.finish_upload, pdf_file, workflow, publication, result.id)
             
         except Exception as e:
             logger.error(f"Error uploading {pdf_file.name}: {e}")
+            if leased:
+                await asyncio.to_thread(self.release_failed, leased)
+
+    def enqueue(self, pdf_file: Path):
+        """Add a file to the upload queue, unless it is already queued or uploading"""
+        if self.queue is None or pdf_file in self.queued:
+            return
+        try:
+            age = pdf_file.stat().st_mtime
+        except FileNotFoundError:
+            return
+
+        _, date_str = split_filename(pdf_file)
+        priority = PRIORITY_TODAY if date_str == datetime.now().strftime(date_format) else PRIORITY_BACKLOG
+        self.queued.add(pdf_file)
+        self.queue.put_nowait((priority, age, str(pdf_file)))
+
+    async def upload_worker(self):
+        """Take files from the queue and upload them, one at a time per worker"""
+        assert self.queue is not None
+        while True:
+            _, _, path = await self.queue.get()
+            pdf_file = Path(path)
+            self.in_flight += 1
+            self.status = "running"
+            try:
+                await self.upload_file(pdf_file)
+            finally:
+                self.queued.discard(pdf_file)
+                self.in_flight -= 1
+                if not self.in_flight:
+                    self.status = "waiting"
+                self.queue.task_done()
+
+    def get_pending_files(self) -> list[Path]:
+        """Files of the workflows waiting in the upload queue"""
+        pdf_files = [self.ocr_folder / get_fw_filename(fw) for fw in FileWorkflow.pending(STATE_PROCESSED)]
+        return [f for f in pdf_files if promote_staged(f)]
+
+    async def serve(self):
+        """Feed the upload queue from stage notifications while the workers drain it"""
+        self.queue = asyncio.PriorityQueue()
+        workers = [asyncio.create_task(self.upload_worker()) for _ in range(config.TELEGRAM_UPLOAD_CONCURRENCY)]
+        logger.info(f"Uploading up to {len(workers)} files at once")
+
+        ready: set[Path] = set()
+        while True:
+            try:
+                # Files reported ready by the watcher or the OCR stage; upload queue on the fallback sweep
+                if ready:
+                    pdf_files = sorted(f for f in ready if f.exists())
+                else:
+                    pdf_files = await asyncio.to_thread(self.get_pending_files)
+                
+                for pdf_file in pdf_files:
+                    self.enqueue(pdf_file)
+                
+            except Exception as e:
+                logger.error(f"Error in Telegram uploader thread: {e}")
+
+            await asyncio.to_thread(events.wait, events.STAGE_UPLOAD, UPLOADER_DELAY)
+            ready = events.take(events.STAGE_UPLOAD)
     
     def run(self):
         logger.info("Telegram uploader thread running")
@@ -141,18 +314,12 @@ class TelegramUploaderThread(threading.Thread):
             logger.error("Failed to setup Telegram client, thread exiting")
             return
         
-        while True:
-            try:
-                self.status = "running"
-                # Find all PDF files (not .temp.pdf)
-                pdf_files = [f for f in self.ocr_folder.glob("*.pdf") if not f.name.endswith(".temp.pdf")]
-                
-                for pdf_file in pdf_files:
-                    self.upload_file(pdf_file)
-                
-            except Exception as e:
-                logger.error(f"Error in Telegram uploader thread: {e}")
-            finally:
-                self.status = "waiting"
+        self.watcher = FolderWatcher(
+            self.ocr_folder,
+            accept=self.is_upload_candidate,
+            on_ready=lambda path: events.notify(events.STAGE_UPLOAD, path),
+            poll_interval=config.WATCHER_POLL_INTERVAL,
+        )
+        self.watcher.start()
 
-            time.sleep(UPLOADER_DELAY)
+        self.loop.run_until_complete(self.serve())